@@ -0,0 +1,85 @@
+import datetime
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure-Python path gives the same numbers
+    np = None
+
+
+'''
+Time-series helpers for the utilization report.
+
+The SQL side hands over sparse (date, value) aggregates; these helpers lay them
+out on a dense day axis and do the rolling-average and stock-out math over
+whole series at once, using NumPy when it is installed.
+'''
+
+ROLLING_WINDOW = 7
+
+
+def day_range(start, end):
+    # every date from start to end inclusive, as "YYYY-MM-DD" strings
+    days = []
+    d = start
+    while d <= end:
+        days.append(d.strftime("%Y-%m-%d"))
+        d += datetime.timedelta(days=1)
+    return days
+
+
+def densify(rows, days):
+    # rows: iterable of (day, value); days missing from rows count as 0
+    index = {day: i for i, day in enumerate(days)}
+    series = [0] * len(days)
+    for day, value in rows:
+        i = index.get(day)
+        if i is not None:
+            series[i] += value
+    return series
+
+
+def rolling_mean(values, window=ROLLING_WINDOW):
+    # trailing mean; the first window - 1 entries average the days available so far
+    if len(values) == 0:
+        return []
+    if np is not None:
+        arr = np.asarray(values, dtype=float)
+        csum = np.cumsum(arr)
+        sums = csum.copy()
+        sums[window:] = csum[window:] - csum[:-window]
+        counts = np.minimum(np.arange(1, len(arr) + 1), window)
+        return (sums / counts).tolist()
+
+    out = []
+    running = 0.0
+    for i, value in enumerate(values):
+        running += value
+        if i >= window:
+            running -= values[i - window]
+        out.append(running / min(i + 1, window))
+    return out
+
+
+def ratios(numerators, denominators):
+    # element-wise numerator / denominator, None where the denominator is 0
+    if np is not None:
+        num = np.asarray(numerators, dtype=float)
+        den = np.asarray(denominators, dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            out = num / den
+        return [None if d == 0 else float(v) for v, d in zip(out, den)]
+    return [None if d == 0 else n / d for n, d in zip(numerators, denominators)]
+
+
+def stock_out_forecast(doses, burn_rates, as_of):
+    # days of stock left at each burn rate, and the date stock runs out;
+    # (None, None) for vaccines that are not being consumed
+    days_left = ratios(doses, burn_rates)
+    forecast = []
+    for left in days_left:
+        if left is None:
+            forecast.append((None, None))
+        else:
+            stock_out = as_of + datetime.timedelta(days=int(left))
+            forecast.append((left, stock_out.strftime("%Y-%m-%d")))
+    return forecast
@@ -0,0 +1,45 @@
+import sys
+sys.path.append("../db/*")
+from db.Sites import SITE_ID_RANGE, get_site_number, get_site_by_number
+
+
+'''
+Appointment IDs that are unique across sites and never reused.
+
+Each site books into its own database, so the IDs of a site are allocated by
+that site alone, inside the booking transaction, and never take a lock on the
+shared database. Every site owns a range of SITE_ID_RANGE IDs picked by its
+site number: the default site (number 0) books 1, 2, 3, ..., site number n
+books from n * SITE_ID_RANGE + 1 on. The site of an appointment therefore
+follows from its ID alone, whatever site the user has selected.
+
+AppointmentSequence remembers the last ID handed out, so an ID freed by a
+cancel or moved to the archive is never given to another appointment.
+'''
+
+def get_id_base(site=None):
+    # IDs of `site` are id_base + 1, id_base + 2, ...
+    return get_site_number(site) * SITE_ID_RANGE
+
+
+def next_appointment_ids(cursor, id_base, count=1):
+    # write unit step: the next `count` IDs of the site whose database `cursor` is on
+    cursor.execute("SELECT LastID FROM AppointmentSequence")
+    row = cursor.fetchone()
+    last = id_base
+    if row is not None and row[0] is not None:
+        last = max(last, row[0])
+    if last + count > id_base + SITE_ID_RANGE:
+        raise ValueError("No appointment IDs left for this site")
+    if row is None:
+        cursor.execute("INSERT INTO AppointmentSequence(LastID) VALUES (?)", (last + count,))
+    else:
+        cursor.execute("UPDATE AppointmentSequence SET LastID = ?", (last + count,))
+    return list(range(last + 1, last + count + 1))
+
+
+def get_appointment_site(appointment_id):
+    # the site that booked `appointment_id`; ValueError if no site owns its range
+    if appointment_id < 1:
+        raise ValueError("Unknown appointment ID " + str(appointment_id))
+    return get_site_by_number((appointment_id - 1) // SITE_ID_RANGE)
@@ -0,0 +1,144 @@
+import sqlite3
+import os
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Backend import get_backend
+
+
+'''
+Cold storage for past appointments.
+
+Old rows are moved out of the hot Appointments table into the same table in a
+separate SQLite file, which is ATTACHed to the connection as "archive" only
+when a query actually needs it. The hot database remembers the archive cutoff
+(every archived appointment is dated before it), so history queries whose range
+starts on or after the cutoff never touch the archive file.
+'''
+
+ARCHIVE_CHUNK_SIZE = 500
+
+# columns shared by main.Appointments and archive.Appointments, in union order
+APPOINTMENT_COLUMNS = "AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot"
+
+create_archive_appointments = """
+    CREATE TABLE IF NOT EXISTS archive.Appointments (
+        AppointmentID INTEGER PRIMARY KEY,
+        Time date,
+        CaregiverUsername varchar(255),
+        PatientUsername varchar(255),
+        VaccineName varchar(255),
+        Slot int NOT NULL DEFAULT 0
+    )
+"""
+
+
+def get_archive_path(db_path=None):
+    # ARCHIVE_DBPATH wins for the default database, otherwise the archive sits
+    # next to the database it was moved out of (DBPATH or a site's file)
+    archive_path = os.getenv("ARCHIVE_DBPATH")
+    if archive_path and db_path in (None, os.getenv("DBPATH")):
+        return archive_path
+    root, ext = os.path.splitext(db_path or os.getenv("DBPATH"))
+    return root + "-archive" + (ext or ".db")
+
+
+def attach_archive(conn, db_path=None):
+    # ATTACH is not allowed inside a transaction, so call this before any writes
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA database_list")
+    if any(row[1] == "archive" for row in cursor.fetchall()):
+        return
+    backend = get_backend(db_path or os.getenv("DBPATH"))
+    cursor.execute("ATTACH DATABASE ? AS archive", (backend.attach_target(get_archive_path(db_path)),))
+    cursor.execute(create_archive_appointments)
+    # archives written before appointments had slots
+    cursor.execute("PRAGMA archive.table_info(Appointments)")
+    if not any(row[1] == "Slot" for row in cursor.fetchall()):
+        cursor.execute("ALTER TABLE archive.Appointments ADD COLUMN Slot int NOT NULL DEFAULT 0")
+
+
+def get_archive_cutoff(cursor):
+    cursor.execute("SELECT Cutoff FROM ArchiveState")
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    return row[0]
+
+
+def appointments_source(conn, start=None, db_path=None):
+    # Returns the FROM clause for appointment history starting at `start`
+    # (None means "all history"). The archive is only attached and unioned in
+    # when the range reaches back before the archive cutoff.
+    cutoff = get_archive_cutoff(conn.cursor())
+    if cutoff is None or (start is not None and start >= cutoff):
+        return "main.Appointments"
+    attach_archive(conn, db_path)
+    return (
+        f"(SELECT {APPOINTMENT_COLUMNS} FROM main.Appointments "
+        f"UNION ALL SELECT {APPOINTMENT_COLUMNS} FROM archive.Appointments)"
+    )
+
+
+def archive_appointments_before(before, chunk_size=ARCHIVE_CHUNK_SIZE, vacuum=False, site=None):
+    # Moves appointments dated before `before` into the archive file, one
+    # committed chunk at a time so the write lock is never held for long.
+    # AppointmentSequence remembers the last ID handed out, so archived IDs are
+    # never handed out again.
+    cm = ConnectionManager(site)
+    conn = cm.create_connection()
+    moved = 0
+    try:
+        attach_archive(conn, cm.db_path)
+        cursor = conn.cursor()
+
+        select_chunk = """
+            SELECT AppointmentID
+            FROM main.Appointments
+            WHERE date(Time) < date(?)
+            ORDER BY AppointmentID ASC
+            LIMIT ?
+        """
+        while True:
+            cursor.execute(select_chunk, (before, chunk_size))
+            ids = [row[0] for row in cursor.fetchall()]
+            if len(ids) == 0:
+                break
+
+            placeholders = ", ".join("?" for _ in ids)
+            cursor.execute(
+                f"INSERT INTO archive.Appointments ({APPOINTMENT_COLUMNS}) "
+                f"SELECT {APPOINTMENT_COLUMNS} FROM main.Appointments WHERE AppointmentID IN ({placeholders})",
+                ids,
+            )
+            cursor.execute(f"DELETE FROM main.Appointments WHERE AppointmentID IN ({placeholders})", ids)
+
+            # the cutoff only ever moves forward, and is written with the chunk
+            # so readers never see archived rows without knowing to look for them
+            cutoff = get_archive_cutoff(cursor)
+            if cutoff is None:
+                cursor.execute("INSERT INTO ArchiveState(Cutoff) VALUES (?)", (before,))
+            elif cutoff < before:
+                cursor.execute("UPDATE ArchiveState SET Cutoff = ?", (before,))
+            conn.commit()
+            moved += len(ids)
+
+        if vacuum and moved > 0:
+            # hand the freed pages back to the file system
+            cursor.execute("VACUUM main")
+
+        # measured on the live database: in memory mode the file on disk is
+        # only the last snapshot
+        cursor.execute("PRAGMA main.page_count")
+        page_count = cursor.fetchone()[0]
+        cursor.execute("PRAGMA main.page_size")
+        hot_size = page_count * cursor.fetchone()[0]
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        cm.close_connection()
+
+    archive_path = get_archive_path(cm.db_path)
+    archive_size = os.path.getsize(archive_path) if os.path.exists(archive_path) else 0
+    return moved, hot_size, archive_size
@@ -0,0 +1,166 @@
+import atexit
+import itertools
+import os
+import sqlite3
+import threading
+from urllib.request import pathname2url
+
+
+'''
+Storage backends behind ConnectionManager.
+
+A backend hands out sqlite3 connections for one database. FileBackend is the
+original behaviour: every connection opens the file at DBPATH.
+MemoryBackend loads the file into an in-memory database shared by all
+connections of this process. It writes the database back to the file with the
+sqlite backup API every DB_SNAPSHOT_SECONDS and on shutdown. Writes made after
+the last snapshot are lost if the process crashes, so use it only for
+benchmarks, tests and demo deployments that want throughput more than
+durability. The in-memory copy is private to the process, so it must not be
+used with several processes sharing one DBPATH.
+
+DB_BACKEND selects the implementation: "file" (default) or "memory".
+'''
+
+DB_BACKEND = os.getenv("DB_BACKEND", "file")
+
+DB_SNAPSHOT_SECONDS = float(os.getenv("DB_SNAPSHOT_SECONDS", "30"))
+
+# the operating system's on-disk VFS
+DISK_VFS = "win32" if os.name == "nt" else "unix"
+
+
+class StorageBackend:
+
+    def connect(self, timeout):
+        # returns a new sqlite3 connection to this backend's database
+        raise NotImplementedError
+
+    def shutdown(self):
+        # flushes anything the backend holds and releases its resources
+        pass
+
+    def attach_target(self, path):
+        # what to ATTACH from one of this backend's connections to reach the
+        # database file at `path` on disk
+        return path
+
+
+class FileBackend(StorageBackend):
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+
+    def connect(self, timeout):
+        return sqlite3.connect(self.db_path, timeout=timeout)
+
+
+class MemoryBackend(StorageBackend):
+
+    instance_ids = itertools.count(1)
+
+    def __init__(self, db_path, snapshot_seconds=DB_SNAPSHOT_SECONDS):
+        self.db_path = db_path
+        self.snapshot_seconds = snapshot_seconds
+        self.lock = threading.Lock()
+        self.timer = None
+        self.closed = False
+
+        # the memdb VFS gives ordinary database locking between connections;
+        # older SQLite builds fall back to a shared-cache in-memory database
+        name = f"scheduler-{os.getpid()}-{next(MemoryBackend.instance_ids)}"
+        self.uri = f"file:/{name}?vfs=memdb"
+        try:
+            self.keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+        except sqlite3.OperationalError:
+            self.uri = f"file:{name}?mode=memory&cache=shared"
+            self.keeper = sqlite3.connect(self.uri, uri=True, check_same_thread=False)
+
+        # the keeper connection keeps the in-memory database alive
+        if db_path is not None and os.path.exists(db_path):
+            source = sqlite3.connect(db_path)
+            try:
+                source.backup(self.keeper)
+            finally:
+                source.close()
+
+        atexit.register(self.shutdown)
+        self.schedule_snapshot()
+
+    def connect(self, timeout):
+        return sqlite3.connect(self.uri, uri=True, timeout=timeout)
+
+    def attach_target(self, path):
+        # an attached database inherits the main database's VFS, so with memdb
+        # a plain path would attach a throwaway in-memory database instead
+        if "vfs=memdb" not in self.uri:
+            return path
+        return f"file:{pathname2url(os.path.abspath(path))}?vfs={DISK_VFS}"
+
+    def schedule_snapshot(self):
+        if self.snapshot_seconds <= 0 or self.closed:
+            return
+        self.timer = threading.Timer(self.snapshot_seconds, self.periodic_snapshot)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def periodic_snapshot(self):
+        try:
+            self.snapshot()
+        except sqlite3.Error as db_err:
+            print("Error while snapshotting in-memory database!")
+            print(db_err)
+        self.schedule_snapshot()
+
+    def snapshot(self):
+        # copy into a temp file and swap it in, so the file on disk is always
+        # a complete snapshot even if the process dies mid-copy
+        if self.db_path is None:
+            return
+        with self.lock:
+            if self.closed:
+                return
+            tmp_path = self.db_path + ".snapshot"
+            target = sqlite3.connect(tmp_path)
+            try:
+                self.keeper.backup(target)
+            finally:
+                target.close()
+            os.replace(tmp_path, self.db_path)
+
+    def shutdown(self):
+        if self.closed:
+            return
+        if self.timer is not None:
+            self.timer.cancel()
+        self.snapshot()
+        with self.lock:
+            self.closed = True
+            self.keeper.close()
+
+
+# one backend per database path, created on first use
+backends = {}
+
+backends_lock = threading.Lock()
+
+
+def get_backend(db_path):
+    with backends_lock:
+        backend = backends.get(db_path)
+        if backend is None:
+            if DB_BACKEND == "memory":
+                backend = MemoryBackend(db_path)
+            elif DB_BACKEND == "file":
+                backend = FileBackend(db_path)
+            else:
+                raise ValueError("Unknown DB_BACKEND: " + DB_BACKEND)
+            backends[db_path] = backend
+        return backend
+
+
+def shutdown_backends():
+    with backends_lock:
+        for backend in backends.values():
+            backend.shutdown()
+        backends.clear()
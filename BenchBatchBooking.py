@@ -0,0 +1,135 @@
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+
+import Scheduler
+from LoadTest import run_command
+from model.Patient import Patient
+from model.BookingWindow import BookingWindow
+
+
+'''
+Benchmark: per-request reserve vs. batch booking with optimal matching.
+
+Builds a database with a few popular dates and a burst of requests, each
+accepting several dates. The per-request path calls Scheduler.reserve for each
+request and tries its dates in order, like a patient retrying at the kiosk. The
+batch path submits every request to a BookingWindow and commits one matching.
+Both start from identical copies of the database.
+
+usage: python BenchBatchBooking.py --schema create.sql --requests 1000 --choices 2
+'''
+
+VACCINE = "benchvax"
+
+
+def build_template(args, path, dates):
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    with open(args.schema) as f:
+        conn.executescript(f.read())
+
+    # accounts are inserted directly, the benchmark never logs in
+    caregivers = [f"benchcg{i:04d}" for i in range(args.caregivers)]
+    conn.executemany("INSERT INTO Caregivers(Username, Salt, Hash) VALUES (?, ?, ?)",
+                     [(c, b"", b"") for c in caregivers])
+    conn.executemany("INSERT INTO Patients(Username, Salt, Hash) VALUES (?, ?, ?)",
+                     [(f"benchpt{i:06d}", b"", b"") for i in range(args.requests)])
+
+    # each caregiver works a random subset of the dates
+    rng = random.Random(args.seed)
+    availability = []
+    for caregiver in caregivers:
+        for date in dates:
+            if rng.random() < args.coverage:
+                availability.append((date + " 00:00:00", caregiver))
+    conn.executemany("INSERT INTO Availabilities(Time, Username) VALUES (?, ?)", availability)
+    conn.execute("INSERT INTO Vaccines(Name, Doses) VALUES (?, ?)", (VACCINE, args.doses))
+    conn.execute("INSERT INTO Restocks(Time, VaccineName, Doses) VALUES (?, ?, ?)", (dates[0], VACCINE, args.doses))
+    conn.commit()
+    conn.close()
+    return len(availability)
+
+
+def make_requests(args, dates):
+    # early dates are more popular, which is what makes greedy booking lose seats
+    rng = random.Random(args.seed + 1)
+    weights = [1.0 / (i + 1) for i in range(len(dates))]
+    requests = []
+    for i in range(args.requests):
+        acceptable = []
+        while len(acceptable) < min(args.choices, len(dates)):
+            date = rng.choices(dates, weights)[0]
+            if date not in acceptable:
+                acceptable.append(date)
+        requests.append((f"benchpt{i:06d}", VACCINE, acceptable))
+    return requests
+
+
+def run_per_request(requests):
+    booked = 0
+    began = time.perf_counter()
+    for patient, vaccine, acceptable in requests:
+        Scheduler.current_patient = Patient(patient)
+        for date in acceptable:
+            if "Appointment ID" in run_command(Scheduler.reserve, ["reserve", date, vaccine]):
+                booked += 1
+                break
+    Scheduler.current_patient = None
+    return booked, time.perf_counter() - began
+
+
+def run_batch(requests):
+    began = time.perf_counter()
+    window = BookingWindow()
+    for patient, vaccine, acceptable in requests:
+        window.submit(patient, vaccine, acceptable)
+    results = window.flush()
+    return sum(1 for r in results if r is not None), time.perf_counter() - began
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare per-request reserve with batch matching")
+    parser.add_argument("--schema", required=True, help="create.sql")
+    parser.add_argument("--workdir", default=".", help="where the benchmark databases are written")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--caregivers", type=int, default=400)
+    parser.add_argument("--dates", type=int, default=5)
+    parser.add_argument("--coverage", type=float, default=0.5, help="chance a caregiver works a given date")
+    parser.add_argument("--choices", type=int, default=2, help="acceptable dates per request")
+    parser.add_argument("--doses", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    first_day = datetime.date(2030, 1, 1)
+    dates = [(first_day + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(args.dates)]
+    template = os.path.join(args.workdir, "bench-template.db")
+    target = os.path.join(args.workdir, "bench.db")
+    slots = build_template(args, template, dates)
+    requests = make_requests(args, dates)
+    os.environ["DBPATH"] = target
+
+    print(f"Requests: {len(requests)}  Caregiver-days: {slots}  Dates: {len(dates)}")
+    print("Path Booked Seconds Requests/s")
+
+    shutil.copy(template, target)
+    booked, seconds = run_per_request(requests)
+    print(f"per-request {booked} {seconds:.3f} {len(requests) / seconds:.1f}")
+
+    shutil.copy(template, target)
+    booked, seconds = run_batch(requests)
+    print(f"batch {booked} {seconds:.3f} {len(requests) / seconds:.1f}")
+
+    os.remove(template)
+    os.remove(target)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+import threading
+from collections import deque
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.Matching import match_requests
+from util.Slots import first_free_slot, free_slot_count, slot_bit
+from db.Transaction import run_transaction
+from db.Events import append_events
+from db.AppointmentIds import get_id_base, next_appointment_ids
+
+
+class BookingWindow:
+    '''
+    Collects reservation requests, each with a list of acceptable dates, and
+    books them together: the request-to-date assignment is solved as a maximum
+    matching under dose and caregiver limits, and every resulting appointment is
+    committed in a single transaction. The caller decides when a batch is
+    complete and calls flush(); batch_reserve does so once per request file.
+    '''
+
+    def __init__(self, site=None):
+        self.site = site
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def submit(self, patient_username, vaccine_name, dates):
+        # returns the request's position in the batch
+        with self.lock:
+            self.requests.append((patient_username, vaccine_name, list(dates)))
+            return len(self.requests) - 1
+
+    def pending(self):
+        # the requests collected so far, in submission order
+        with self.lock:
+            return list(self.requests)
+
+    def flush(self):
+        # books the collected requests; returns (appointment_id, caregiver, date, slot)
+        # or None for every request, in submission order
+        with self.lock:
+            requests = self.requests
+            self.requests = []
+        if len(requests) == 0:
+            return []
+        id_base = get_id_base(self.site)
+        return run_transaction(lambda cursor: book_requests(cursor, requests, id_base), site=self.site)
+
+
+def book_requests(cursor, requests, id_base):
+    # write unit: reads current availability and stock under the write lock,
+    # solves the matching and applies it with bulk statements; IDs come from
+    # the range starting after `id_base`
+    dates = sorted({date for _, _, acceptable in requests for date in acceptable})
+    vaccines = sorted({vaccine for _, vaccine, _ in requests})
+
+    caregivers = {date: deque() for date in dates}
+    if len(dates) > 0:
+        placeholders = ", ".join("?" for _ in dates)
+        get_caregivers = f"""
+            SELECT rowid AS RowID, date(Time) AS Day, Username, FreeSlots
+            FROM Availabilities
+            WHERE date(Time) IN ({placeholders}) AND FreeSlots != 0
+            ORDER BY Username ASC
+        """
+        cursor.execute(get_caregivers, dates)
+        for row in cursor.fetchall():
+            caregivers[row["Day"]].append([row["RowID"], row["Username"], row["FreeSlots"]])
+
+    doses = {}
+    if len(vaccines) > 0:
+        placeholders = ", ".join("?" for _ in vaccines)
+        cursor.execute(f"SELECT Name, Doses FROM Vaccines WHERE Name IN ({placeholders})", vaccines)
+        for row in cursor.fetchall():
+            doses[row["Name"]] = row["Doses"] or 0
+
+    # a date can take as many bookings as its caregivers have free slots
+    slots = {date: sum(free_slot_count(c[2]) for c in day) for date, day in caregivers.items()}
+    matched = match_requests([(vaccine, acceptable) for _, vaccine, acceptable in requests], doses, slots)
+
+    ids = iter(next_appointment_ids(cursor, id_base, sum(1 for date in matched if date is not None)))
+
+    # caregivers of a date are handed out alphabetically, in request order,
+    # each one's earliest free slot first
+    results = []
+    appointments = []
+    remaining = {}  # availability rowid -> free slots left
+    for (patient, vaccine, _), date in zip(requests, matched):
+        if date is None:
+            results.append(None)
+            continue
+        availability = caregivers[date][0]
+        availability_rowid, caregiver, free_slots = availability
+        slot = first_free_slot(free_slots)
+        availability[2] = free_slots & ~slot_bit(slot)
+        remaining[availability_rowid] = availability[2]
+        if availability[2] == 0:
+            caregivers[date].popleft()
+        appt_id = next(ids)
+        appointments.append((appt_id, date, caregiver, patient, vaccine, slot))
+        results.append((appt_id, caregiver, date, slot))
+
+    insert_appointment = """
+        INSERT INTO Appointments(AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    cursor.executemany(insert_appointment, appointments)
+    cursor.executemany(
+        "UPDATE Availabilities SET FreeSlots = ? WHERE rowid = ?",
+        [(free_slots, rowid) for rowid, free_slots in remaining.items()],
+    )
+    cursor.executemany(
+        "DELETE FROM Availabilities WHERE rowid = ? AND FreeSlots = 0",
+        [(rowid,) for rowid in remaining],
+    )
+
+    used = {}
+    for _, _, _, _, vaccine, _ in appointments:
+        used[vaccine] = used.get(vaccine, 0) + 1
+    cursor.executemany("UPDATE Vaccines SET Doses = Doses - ? WHERE Name = ?", [(n, v) for v, n in used.items()])
+
+    append_events(cursor, "reserve", [
+        {"appointment_id": appt_id, "date": date, "caregiver": caregiver, "patient": patient, "vaccine": vaccine,
+         "slot": slot}
+        for appt_id, date, caregiver, patient, vaccine, slot in appointments
+    ])
+    return results
@@ -3,15 +3,21 @@ import sys
 sys.path.append("../util/*")
 sys.path.append("../db/*")
 from util.Util import Util
+from util.Slots import DEFAULT_SHIFT_START, DEFAULT_SHIFT_END, parse_clock, shift_bitmap
 from db.ConnectionManager import ConnectionManager
+from db.Transaction import run_transaction
+from db.Events import append_event, append_events
 
 
 class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, site=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        # whether get() ran the password hash (only when the username exists)
+        self.hash_checked = False
+        self.site = site
 
     # getters
     def get(self):
@@ -19,13 +25,14 @@ class Caregiver:
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = ?"
+        get_caregiver_details = "SELECT Salt, Hash, Site FROM Caregivers WHERE Username = ?"
         try:
             cursor.execute(get_caregiver_details, (self.username,))
             for row in cursor:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
                 calculated_hash = Util.generate_hash(self.password, curr_salt)
+                self.hash_checked = True
                 if not curr_hash == calculated_hash:
                     # print("Incorrect password")
                     cm.close_connection()
@@ -33,6 +40,7 @@ class Caregiver:
                 else:
                     self.salt = curr_salt
                     self.hash = calculated_hash
+                    self.site = row['Site']
                     cm.close_connection()
                     return self
         except sqlite3.Error as e:
@@ -50,14 +58,17 @@ class Caregiver:
     def get_hash(self):
         return self.hash
 
+    def get_site(self):
+        return self.site
+
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_caregivers = "INSERT INTO Caregivers VALUES (?, ?, ?)"
+        add_caregivers = "INSERT INTO Caregivers(Username, Salt, Hash, Site) VALUES (?, ?, ?, ?)"
         try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash, self.site))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
         except sqlite3.Error:
@@ -65,19 +76,107 @@ class Caregiver:
         finally:
             cm.close_connection()
 
-    # Insert availability with parameter date d
-    def upload_availability(self, d):
+    # Store this caregiver's shift hours, used for days uploaded from now on
+    def set_shift(self, start_minute, end_minute):
+        set_shift = "INSERT OR REPLACE INTO Shifts(Username, StartMinute, EndMinute) VALUES (?, ?, ?)"
+        run_transaction(lambda cursor: cursor.execute(set_shift, (self.username, start_minute, end_minute)))
+
+    # Bitmap of the slots in this caregiver's shift, read from the accounts database
+    def get_shift_bitmap(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT StartMinute, EndMinute FROM Shifts WHERE Username = ?", (self.username,))
+            row = cursor.fetchone()
+        finally:
+            cm.close_connection()
+        if row is None:
+            return shift_bitmap(parse_clock(DEFAULT_SHIFT_START), parse_clock(DEFAULT_SHIFT_END))
+        return shift_bitmap(row["StartMinute"], row["EndMinute"])
+
+    # Insert availability with parameter date d
+    def upload_availability(self, d):
+        # the primary key compares Time as stored, so a day synced or re-created
+        # in another format is matched by date(Time) instead
+        add_availability = """
+            INSERT INTO Availabilities(Time, Username, FreeSlots)
+            SELECT ?, ?, ?
+            WHERE NOT EXISTS (SELECT 1 FROM Availabilities WHERE date(Time) = date(?) AND Username = ?)
+        """
+
+        # shifts are account data, while availability lives in the caregiver's site
+        free_slots = self.get_shift_bitmap()
+
+        def unit(cursor):
+            cursor.execute(add_availability, (d, self.username, free_slots, d, self.username))
+            if cursor.rowcount == 0:
+                raise sqlite3.IntegrityError("UNIQUE constraint failed: Availabilities.Time, Availabilities.Username")
+            append_event(cursor, "availability", date=d.strftime("%Y-%m-%d"), caregiver=self.username)
 
-        add_availability = "INSERT INTO Availabilities VALUES (? , ?)"
         try:
-            cursor.execute(add_availability, (d, self.username))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
+            # retried as a whole on lock contention
+            run_transaction(unit, site=self.site)
         except sqlite3.Error as e:
             print("Error occurred when updating caregiver availability", e)
             # raise
-        finally:
-            cm.close_connection()
+
+    # Make the available days from `first_day` on exactly `days` (dates as
+    # "YYYY-MM-DD"), except that days with appointments or holds are never
+    # removed. Returns (day, action) pairs sorted by day, action being "added",
+    # "removed" or "conflict" (booked, so kept although not wanted).
+    def sync_availability(self, days, first_day):
+        free_slots = self.get_shift_bitmap()
+
+        def unit(cursor):
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS DesiredDays (Day date PRIMARY KEY)")
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS SyncDays (Day date PRIMARY KEY, Action varchar(16))")
+            cursor.execute("DELETE FROM temp.DesiredDays")
+            cursor.execute("DELETE FROM temp.SyncDays")
+            cursor.executemany("INSERT OR IGNORE INTO temp.DesiredDays VALUES (?)",
+                               [(day,) for day in days if day >= first_day])
+
+            # the three sets the diff works on, all from first_day on
+            offered = "SELECT date(Time) FROM Availabilities WHERE Username = :user AND date(Time) >= :first"
+            booked = """
+                SELECT Day FROM (
+                    SELECT date(Time) AS Day FROM Appointments
+                    WHERE CaregiverUsername = :user AND date(Time) >= :first
+                    UNION
+                    SELECT date(Time) FROM Holds WHERE CaregiverUsername = :user AND date(Time) >= :first
+                )
+            """
+            desired = "SELECT date(Day) FROM temp.DesiredDays"
+            params = {"user": self.username, "first": first_day}
+
+            # wanted but neither offered nor booked yet (a fully booked day has no availability row)
+            cursor.execute(f"INSERT INTO temp.SyncDays SELECT *, 'added' FROM ({desired} EXCEPT {offered} "
+                           f"EXCEPT {booked})", params)
+            # offered but no longer wanted, as long as nothing is booked that day
+            cursor.execute(f"INSERT INTO temp.SyncDays SELECT *, 'removed' FROM ({offered} EXCEPT {desired} "
+                           f"EXCEPT {booked})", params)
+            # booked but no longer wanted: kept, and reported
+            cursor.execute(f"INSERT INTO temp.SyncDays SELECT *, 'conflict' FROM ({booked} EXCEPT {desired})", params)
+
+            # apply only the difference, storing Time as upload_availability does
+            cursor.execute("""
+                INSERT INTO Availabilities(Time, Username, FreeSlots)
+                SELECT datetime(Day), ?, ? FROM temp.SyncDays WHERE Action = 'added'
+            """, (self.username, free_slots))
+            cursor.execute("""
+                DELETE FROM Availabilities
+                WHERE Username = ? AND date(Time) IN (SELECT Day FROM temp.SyncDays WHERE Action = 'removed')
+            """, (self.username,))
+
+            cursor.execute("SELECT Day, Action FROM temp.SyncDays ORDER BY Day ASC")
+            changes = [(row["Day"], row["Action"]) for row in cursor.fetchall()]
+            append_events(cursor, "availability", [
+                {"date": day, "caregiver": self.username} for day, action in changes if action == "added"
+            ])
+            append_events(cursor, "availability_removed", [
+                {"date": day, "caregiver": self.username} for day, action in changes if action == "removed"
+            ])
+            return changes
+
+        # one transaction, retried as a whole on lock contention
+        return run_transaction(unit, site=self.site)
@@ -1,17 +1,32 @@
 import sqlite3
 import os
+import sys
+sys.path.append("../db/*")
+from db.Backend import get_backend
+from db.Sites import get_site_db_path
+from db.Migrations import ensure_schema
+
+
+# how long a connection waits on a locked database before giving up with SQLITE_BUSY
+BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
 
 
 class ConnectionManager:
 
-    def __init__(self):
-        self.db_path = os.getenv("DBPATH")
+    def __init__(self, site=None):
+        # site None is the shared accounts database at DBPATH (also the default
+        # site); any other site routes to that site's own database file
+        self.site = site
+        self.db_path = get_site_db_path(site)
         self.conn = None
 
     def create_connection(self):
         try:
-            self.conn = sqlite3.connect(self.db_path)
+            # the backend (file or in-memory, see DB_BACKEND) opens the actual connection
+            self.conn = get_backend(self.db_path).connect(BUSY_TIMEOUT_MS / 1000.0)
             self.conn.row_factory = sqlite3.Row
+            # databases from an older create.sql are upgraded on first use
+            ensure_schema(self.conn, self.db_path)
         except sqlite3.Error as db_err:
             print("Database Programming Error in SQL connection processing!")
             print(db_err)
@@ -0,0 +1,67 @@
+import json
+import sys
+import time
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Transaction import run_transaction
+
+
+'''
+Change-data feed of booking events.
+
+Every write unit that changes appointments, availability or stock appends an
+event to the Events table in its own transaction, so an event exists exactly
+when its change was committed. Seq is an AUTOINCREMENT key: it only ever grows,
+even after compaction deletes consumed ranges, so a consumer can remember the
+last Seq it processed and later read only what came after it. Each site has its
+own feed, numbered independently, in its own database.
+'''
+
+EVENT_BATCH_SIZE = 1000
+
+
+def append_event(cursor, kind, **payload):
+    add_event = "INSERT INTO Events(Kind, Payload, CreatedAt) VALUES (?, ?, ?)"
+    cursor.execute(add_event, (kind, json.dumps(payload, sort_keys=True), time.time()))
+
+
+def append_events(cursor, kind, payloads):
+    # bulk form for set-based units
+    now = time.time()
+    add_event = "INSERT INTO Events(Kind, Payload, CreatedAt) VALUES (?, ?, ?)"
+    cursor.executemany(add_event, [(kind, json.dumps(p, sort_keys=True), now) for p in payloads])
+
+
+def changes_since(seq, limit=None, batch_size=EVENT_BATCH_SIZE, site=None):
+    # yields events with Seq > seq in order, as (seq, kind, payload, created_at),
+    # reading the primary key range one batch at a time
+    cm = ConnectionManager(site)
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+
+    get_events = """
+        SELECT Seq, Kind, Payload, CreatedAt
+        FROM Events
+        WHERE Seq > ?
+        ORDER BY Seq ASC
+        LIMIT ?
+    """
+    try:
+        cursor.execute(get_events, (seq, -1 if limit is None else limit))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if len(rows) == 0:
+                break
+            for row in rows:
+                yield row["Seq"], row["Kind"], json.loads(row["Payload"]), row["CreatedAt"]
+    finally:
+        cm.close_connection()
+
+
+def compact_events(upto_seq, site=None):
+    # drops events consumed up to and including upto_seq; returns how many
+    def unit(cursor):
+        cursor.execute("DELETE FROM Events WHERE Seq <= ?", (upto_seq,))
+        return cursor.rowcount
+
+    return run_transaction(unit, site=site)
@@ -0,0 +1,61 @@
+import csv
+import gzip
+import json
+
+
+'''
+Streaming writers for roster exports.
+
+Rows are pulled from an open cursor with fetchmany() in fixed-size batches and
+written straight through a buffered (optionally gzip-compressed) file, so memory
+use depends on the batch size and never on the number of exported rows.
+'''
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+EXPORT_BATCH_SIZE = 5000
+
+# how often (in rows) progress is reported
+EXPORT_PROGRESS_EVERY = 100000
+
+# size of the write buffer in front of the output file
+EXPORT_BUFFER_SIZE = 1 << 20
+
+# slot is the appointment's start time, empty in whole-day mode
+ROSTER_COLUMNS = ("date", "caregiver", "appointment_id", "patient", "vaccine", "slot")
+
+
+def open_export_file(path, compress=False):
+    if compress:
+        return gzip.open(path, "wt", encoding="utf-8", newline="")
+    return open(path, "w", encoding="utf-8", newline="", buffering=EXPORT_BUFFER_SIZE)
+
+
+def write_rows(cursor, out, fmt, columns=ROSTER_COLUMNS, batch_size=EXPORT_BATCH_SIZE, progress=None):
+    # cursor must already be executing a query whose result columns line up
+    # with `columns`; returns the number of rows written
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError("Unknown export format: " + str(fmt))
+
+    writer = None
+    if fmt == "csv":
+        writer = csv.writer(out)
+        writer.writerow(columns)
+
+    count = 0
+    next_report = EXPORT_PROGRESS_EVERY
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if len(rows) == 0:
+            break
+
+        if writer is not None:
+            writer.writerows(rows)
+        else:
+            out.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+        count += len(rows)
+        if progress is not None and count >= next_report:
+            progress(count)
+            next_report = count + EXPORT_PROGRESS_EVERY
+    return count
@@ -0,0 +1,171 @@
+import heapq
+import os
+import threading
+import time
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.Slots import slot_bit
+from db.ConnectionManager import ConnectionManager
+from db.Transaction import run_transaction
+from db.Events import append_events
+
+
+# how long a hold keeps its caregiver slot and dose before it is released
+HOLD_TTL_SECONDS = float(os.getenv("HOLD_TTL_SECONDS", "300"))
+
+# expired holds released per transaction
+HOLD_RELEASE_BATCH = 500
+
+# how often the expiry heap looks for holds placed by other processes; as long
+# as this is shorter than the TTL it learns about them before they expire
+HOLD_REFRESH_SECONDS = float(os.getenv("HOLD_REFRESH_SECONDS", str(HOLD_TTL_SECONDS / 10)))
+
+
+class HoldExpiry:
+    '''
+    Min-heap of (expires_at, hold_id) for the holds of one site, so the holds
+    due for release are always at the top and the common "nothing is due"
+    check never touches the database. Holds placed by this process are pushed
+    as they are committed. Holds placed by other processes, or left behind by
+    one that exited, only exist in the Holds table, so every
+    HOLD_REFRESH_SECONDS the heap reads the holds expiring before the next
+    refresh through the ExpiresAt index (a range scan, never the whole table)
+    and queues the ones it does not know yet. An entry whose hold was confirmed
+    or released elsewhere in the meantime is simply found missing on release.
+    '''
+
+    def __init__(self, site=None):
+        self.site = site
+        self.heap = []
+        self.queued = set()  # hold IDs in the heap
+        self.refreshed_at = None
+        self.lock = threading.Lock()
+
+    def push(self, hold_id, expires_at):
+        # caller holds self.lock
+        if hold_id not in self.queued:
+            heapq.heappush(self.heap, (expires_at, hold_id))
+            self.queued.add(hold_id)
+
+    def refresh(self, now):
+        # queues the holds the database has expiring before the next refresh;
+        # caller holds self.lock
+        cm = ConnectionManager(self.site)
+        conn = cm.create_connection()
+        try:
+            rows = conn.execute(
+                "SELECT ExpiresAt, HoldID FROM Holds WHERE ExpiresAt <= ?", (now + HOLD_REFRESH_SECONDS,)
+            ).fetchall()
+        finally:
+            cm.close_connection()
+        for row in rows:
+            self.push(row["HoldID"], row["ExpiresAt"])
+        self.refreshed_at = now
+
+    def add(self, hold_id, expires_at):
+        with self.lock:
+            self.push(hold_id, expires_at)
+
+    def pop_due(self, now, limit):
+        # hold IDs that expired by `now`, wherever they were placed
+        with self.lock:
+            if self.refreshed_at is None or now - self.refreshed_at >= HOLD_REFRESH_SECONDS:
+                self.refresh(now)
+            due = []
+            while len(self.heap) > 0 and self.heap[0][0] <= now and len(due) < limit:
+                hold_id = heapq.heappop(self.heap)[1]
+                self.queued.discard(hold_id)
+                due.append(hold_id)
+            return due
+
+    def reclaim(self, now=None):
+        # releases every expired hold, one batch per transaction; returns how many
+        now = time.time() if now is None else now
+        released = 0
+        while True:
+            due = self.pop_due(now, HOLD_RELEASE_BATCH)
+            if len(due) == 0:
+                return released
+            try:
+                released += run_transaction(lambda cursor: release_holds(cursor, due, "hold_expired", now),
+                                            site=self.site)
+            except BaseException:
+                # put the batch back so a later reclaim retries it
+                with self.lock:
+                    for hold_id in due:
+                        self.push(hold_id, now)
+                raise
+
+
+# one expiry heap per site, created on first use
+expiries = {}
+
+expiries_lock = threading.Lock()
+
+
+def get_hold_expiry(site=None):
+    with expiries_lock:
+        expiry = expiries.get(site)
+        if expiry is None:
+            expiry = HoldExpiry(site)
+            expiries[site] = expiry
+        return expiry
+
+
+def reclaim_expired_holds(site=None):
+    return get_hold_expiry(site).reclaim()
+
+
+def release_holds(cursor, hold_ids, kind, expired_by=None):
+    # write unit step: gives the slots and doses of the given holds back and
+    # deletes them (only those expired by `expired_by`, when given); returns
+    # how many holds were released
+    if len(hold_ids) == 0:
+        return 0
+    placeholders = ", ".join("?" for _ in hold_ids)
+    get_holds = f"""
+        SELECT HoldID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot
+        FROM Holds
+        WHERE HoldID IN ({placeholders})
+    """
+    params = list(hold_ids)
+    if expired_by is not None:
+        get_holds += " AND ExpiresAt <= ?"
+        params.append(expired_by)
+    cursor.execute(get_holds, params)
+    holds = cursor.fetchall()
+    if len(holds) == 0:
+        return 0
+
+    # 1) slots back to each caregiver-day, re-creating days that were fully taken
+    bits = {}
+    doses = {}
+    for hold in holds:
+        key = (hold["Time"], hold["CaregiverUsername"])
+        bits[key] = bits.get(key, 0) | slot_bit(hold["Slot"])
+        doses[hold["VaccineName"]] = doses.get(hold["VaccineName"], 0) + 1
+    for (day, caregiver), free in bits.items():
+        cursor.execute(
+            "UPDATE Availabilities SET FreeSlots = FreeSlots | ? WHERE date(Time) = date(?) AND Username = ?",
+            (free, day, caregiver),
+        )
+        if cursor.rowcount == 0:
+            cursor.execute(
+                "INSERT OR IGNORE INTO Availabilities(Time, Username, FreeSlots) VALUES (datetime(?), ?, ?)",
+                (day, caregiver, free),
+            )
+
+    # 2) doses back, one statement per vaccine
+    cursor.executemany("UPDATE Vaccines SET Doses = Doses + ? WHERE Name = ?",
+                       [(count, name) for name, count in doses.items()])
+
+    # 3) drop the holds and publish the releases
+    released = [hold["HoldID"] for hold in holds]
+    cursor.execute(f"DELETE FROM Holds WHERE HoldID IN ({', '.join('?' for _ in released)})", released)
+    append_events(cursor, kind, [
+        {"hold_id": hold["HoldID"], "date": hold["Time"], "caregiver": hold["CaregiverUsername"],
+         "patient": hold["PatientUsername"], "vaccine": hold["VaccineName"], "slot": hold["Slot"]}
+        for hold in holds
+    ])
+    return len(holds)
@@ -0,0 +1,74 @@
+import os
+import time
+
+
+'''
+Client request keys for reserve and cancel.
+
+A kiosk can send an optional key with each request. The first execution stores
+its result under (username, key) in the same transaction as the write itself,
+so either both land or neither does. A retry with the same key finds the stored
+result through the primary-key index and returns it without running the write
+path again. Keys expire after REQUEST_KEY_TTL_SECONDS and are pruned a bounded
+batch at a time through the CreatedAt index.
+'''
+
+REQUEST_KEY_TTL_SECONDS = int(os.getenv("REQUEST_KEY_TTL_SECONDS", "86400"))
+
+REQUEST_KEY_PRUNE_BATCH = 100
+
+
+def find_request_result(cursor, username, key, operation, now):
+    get_result = """
+        SELECT Operation, Result
+        FROM RequestKeys
+        WHERE Username = ? AND RequestKey = ? AND CreatedAt >= ?
+    """
+    cursor.execute(get_result, (username, key, now - REQUEST_KEY_TTL_SECONDS))
+    row = cursor.fetchone()
+    if row is None:
+        return None
+    if row[0] != operation:
+        raise ValueError("Request key " + key + " was already used for " + row[0])
+    return row[1]
+
+
+def remember_request_result(cursor, username, key, operation, result, now):
+    # OR REPLACE takes over an expired key that has not been pruned yet
+    add_result = """
+        INSERT OR REPLACE INTO RequestKeys(Username, RequestKey, Operation, Result, CreatedAt)
+        VALUES (?, ?, ?, ?, ?)
+    """
+    cursor.execute(add_result, (username, key, operation, result, now))
+
+
+def prune_request_keys(cursor, now):
+    prune = """
+        DELETE FROM RequestKeys
+        WHERE (Username, RequestKey) IN (
+            SELECT Username, RequestKey
+            FROM RequestKeys
+            WHERE CreatedAt < ?
+            ORDER BY CreatedAt ASC
+            LIMIT ?
+        )
+    """
+    cursor.execute(prune, (now - REQUEST_KEY_TTL_SECONDS, REQUEST_KEY_PRUNE_BATCH))
+
+
+def idempotent(unit, username, key, operation):
+    # wraps a write unit for run_transaction; without a key it is unchanged
+    if key is None:
+        return unit
+
+    def keyed_unit(cursor):
+        now = time.time()
+        prune_request_keys(cursor, now)
+        result = find_request_result(cursor, username, key, operation, now)
+        if result is not None:
+            return result
+        result = unit(cursor)
+        remember_request_result(cursor, username, key, operation, result, now)
+        return result
+
+    return keyed_unit
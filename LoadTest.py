@@ -0,0 +1,306 @@
+import argparse
+import contextlib
+import datetime
+import io
+import multiprocessing
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+
+import Scheduler
+from db.Transaction import get_transaction_stats
+from util.RateLimiter import LoginThrottle
+
+
+'''
+Multi-process load generator for a shared DBPATH.
+
+Each worker process drives a mix of login / search / reserve / cancel /
+show_appointments through the real Scheduler command functions, exactly like
+the CLI does, and records per-operation latency and outcome. The parent merges
+the samples into throughput, latency percentiles and a per-second timeline, then
+checks the database for consistency.
+
+The command functions swallow sqlite errors and print "Please try again", so a
+failed operation is recognised from its output and counted as an error, whatever
+its cause. Lock contention is reported separately from the write units
+(db/Transaction.py) of every worker: the retries they made, and the "give-ups",
+where a unit still found the database locked after its last attempt.
+
+usage: python LoadTest.py --db load.db --schema create.sql --workers 8 --duration 30
+'''
+
+PASSWORD = "Load#Test1"
+
+VACCINE = "loadvax"
+
+# relative weights of the operations in the mix
+OPERATION_MIX = (
+    ("login", 5),
+    ("search", 35),
+    ("reserve", 25),
+    ("cancel", 10),
+    ("show_appointments", 25),
+)
+
+FAILURE_MARKERS = ("Please try again", "failed", "Failed", "Error occurred", "Too many login attempts")
+
+appointment_id_pattern = re.compile(r"Appointment ID (\d+),")
+
+
+def run_command(func, tokens):
+    # runs one Scheduler command and returns what it printed
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        func(tokens)
+    return out.getvalue()
+
+
+def is_failure(output):
+    return any(marker in output for marker in FAILURE_MARKERS)
+
+
+def setup_database(args, dates):
+    if args.schema is not None:
+        if os.path.exists(args.db):
+            os.remove(args.db)
+        conn = sqlite3.connect(args.db)
+        with open(args.schema) as f:
+            conn.executescript(f.read())
+        conn.close()
+
+    for i in range(args.caregivers):
+        username = f"loadcg{i:04d}"
+        run_command(Scheduler.create_caregiver, ["create_caregiver", username, PASSWORD])
+        run_command(Scheduler.login_caregiver, ["login_caregiver", username, PASSWORD])
+        for date in dates:
+            run_command(Scheduler.upload_availability, ["upload_availability", date])
+        if i == 0:
+            run_command(Scheduler.add_doses, ["add_doses", VACCINE, str(args.doses)])
+        run_command(Scheduler.logout, ["logout"])
+
+    for worker_id in range(args.workers):
+        for j in range(args.patients_per_worker):
+            run_command(Scheduler.create_patient, ["create_patient", f"loadpt{worker_id:03d}x{j:03d}", PASSWORD])
+
+
+def worker(worker_id, args, dates, start_at, results):
+    rng = random.Random(args.seed * 1000 + worker_id)
+    patients = [f"loadpt{worker_id:03d}x{j:03d}" for j in range(args.patients_per_worker)]
+    operations = [name for name, _ in OPERATION_MIX]
+    weights = [weight for _, weight in OPERATION_MIX]
+    booked = {}  # patient -> appointment ids made by this worker
+    samples = []
+
+    # every worker is its own client, with login limits sized for the test
+    Scheduler.client_id = f"loadtest-{worker_id}"
+    Scheduler.login_throttle = LoginThrottle(args.login_rate, args.login_rate, args.login_rate, args.login_rate)
+
+    def attempt(func, tokens):
+        retries = 0
+        while True:
+            output = run_command(func, tokens)
+            if not is_failure(output) or retries >= args.retries:
+                return output, retries
+            retries += 1
+            time.sleep(args.retry_delay * (2 ** (retries - 1)))
+
+    patient = None
+    while time.time() < start_at:
+        time.sleep(0.001)
+    deadline = start_at + args.duration
+
+    while time.time() < deadline:
+        operation = "login" if patient is None else rng.choices(operations, weights)[0]
+        began = time.perf_counter()
+        retries = 0
+
+        if operation == "login":
+            run_command(Scheduler.logout, ["logout"])
+            patient = rng.choice(patients)
+            output, retries = attempt(Scheduler.login_patient, ["login_patient", patient, PASSWORD])
+            if is_failure(output):
+                patient = None
+        elif operation == "search":
+            output, retries = attempt(Scheduler.search_caregiver_schedule,
+                                      ["search_caregiver_schedule", rng.choice(dates)])
+        elif operation == "reserve":
+            output, retries = attempt(Scheduler.reserve, ["reserve", rng.choice(dates), VACCINE])
+            match = appointment_id_pattern.search(output)
+            if match:
+                booked.setdefault(patient, []).append(int(match.group(1)))
+        elif operation == "cancel":
+            mine = booked.get(patient)
+            if not mine:
+                continue
+            appointment_id = mine.pop(rng.randrange(len(mine)))
+            output, retries = attempt(Scheduler.cancel, ["cancel", str(appointment_id)])
+            if is_failure(output):
+                mine.append(appointment_id)
+        else:
+            output, retries = attempt(Scheduler.show_appointments, ["show_appointments"])
+
+        finished = time.perf_counter()
+        samples.append((time.time() - start_at, operation, finished - began, is_failure(output), retries))
+
+    results.put((worker_id, samples, get_transaction_stats()))
+
+
+def percentile(sorted_values, pct):
+    if len(sorted_values) == 0:
+        return 0.0
+    k = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[k]
+
+
+def report(samples, stats, duration):
+    print(f"Operations: {len(samples)}  Throughput: {len(samples) / duration:.1f} ops/s")
+    errors = sum(1 for s in samples if s[3])
+    retries = sum(s[4] for s in samples)
+    rate = errors / len(samples) * 100 if samples else 0.0
+    print(f"Errors: {errors} ({rate:.2f}%)  Client retries: {retries}")
+    print(f"Database is locked (give-ups): {stats['give_ups']}  Transaction retries: {stats['retries']}  "
+          f"Lock wait: {stats['lock_wait_seconds']:.3f}s")
+
+    print("Operation Count p50_ms p95_ms p99_ms Errors")
+    for name, _ in OPERATION_MIX:
+        latencies = sorted(s[2] * 1000 for s in samples if s[1] == name)
+        op_errors = sum(1 for s in samples if s[1] == name and s[3])
+        print(f"{name} {len(latencies)} {percentile(latencies, 50):.1f} "
+              f"{percentile(latencies, 95):.1f} {percentile(latencies, 99):.1f} {op_errors}")
+
+    print("Second Ops Errors Retries")
+    timeline = {}
+    for offset, _, _, failed, tries in samples:
+        bucket = timeline.setdefault(int(offset), [0, 0, 0])
+        bucket[0] += 1
+        bucket[1] += 1 if failed else 0
+        bucket[2] += tries
+    for second in sorted(timeline):
+        ops, errs, tries = timeline[second]
+        print(f"{second} {ops} {errs} {tries}")
+
+
+def check_consistency(db_path):
+    # checks DBPATH and the booking database of every registered site
+    conn = sqlite3.connect(db_path)
+    try:
+        sites = conn.execute("SELECT Name, DBPath FROM Sites ORDER BY Name ASC").fetchall()
+    except sqlite3.OperationalError:
+        sites = []
+    finally:
+        conn.close()
+
+    problems = check_booking_database(db_path)
+    for name, site_path in sites:
+        problems += [f"site {name}: {problem}" for problem in check_booking_database(site_path)]
+    return problems
+
+
+def check_booking_database(db_path):
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    problems = []
+
+    # one appointment per caregiver-day slot (per caregiver-day in whole-day mode)
+    cursor.execute("""
+        SELECT date(Time), CaregiverUsername, Slot, COUNT(*)
+        FROM Appointments
+        GROUP BY date(Time), CaregiverUsername, Slot
+        HAVING COUNT(*) > 1
+    """)
+    for day, caregiver, slot, count in cursor.fetchall():
+        problems.append(f"caregiver {caregiver} double-booked on {day} slot {slot} ({count} appointments)")
+
+    # a booked slot must not also be offered as free
+    cursor.execute("""
+        SELECT date(ap.Time), ap.CaregiverUsername, ap.Slot
+        FROM Appointments ap
+        JOIN Availabilities av
+          ON date(av.Time) = date(ap.Time) AND av.Username = ap.CaregiverUsername
+        WHERE (av.FreeSlots >> ap.Slot) & 1 = 1
+    """)
+    for day, caregiver, slot in cursor.fetchall():
+        problems.append(f"caregiver {caregiver} booked on {day} slot {slot} but still listed as free")
+
+    # doses on hand plus doses booked or held must equal everything ever restocked
+    cursor.execute("""
+        SELECT r.VaccineName, r.Restocked,
+               COALESCE(v.Doses, 0),
+               (SELECT COUNT(*) FROM Appointments ap WHERE ap.VaccineName = r.VaccineName)
+               + (SELECT COUNT(*) FROM Holds h WHERE h.VaccineName = r.VaccineName)
+        FROM (SELECT VaccineName, SUM(Doses) AS Restocked FROM Restocks GROUP BY VaccineName) r
+        LEFT JOIN Vaccines v ON v.Name = r.VaccineName
+    """)
+    for vaccine, restocked, doses, booked in cursor.fetchall():
+        if doses + booked != restocked:
+            problems.append(f"vaccine {vaccine}: {doses} doses + {booked} booked or held != {restocked} restocked")
+        if doses < 0:
+            problems.append(f"vaccine {vaccine} has negative stock ({doses})")
+
+    conn.close()
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Multi-process load test against a shared DBPATH")
+    parser.add_argument("--db", required=True, help="database file shared by every worker")
+    parser.add_argument("--schema", help="create.sql to build a fresh database from (omit to reuse --db as is)")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of load")
+    parser.add_argument("--caregivers", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--doses", type=int, default=10000)
+    parser.add_argument("--patients-per-worker", type=int, default=5)
+    parser.add_argument("--retries", type=int, default=3, help="client retries after a failed operation")
+    parser.add_argument("--retry-delay", type=float, default=0.01, help="first client retry delay in seconds")
+    parser.add_argument("--login-rate", type=float, default=6000.0,
+                        help="per-worker login throttle, attempts per minute (and burst)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    os.environ["DBPATH"] = args.db
+    first_day = datetime.date(2030, 1, 1)
+    dates = [(first_day + datetime.timedelta(days=i)).strftime("%Y-%m-%d") for i in range(args.days)]
+
+    if args.schema is not None:
+        print(f"Setting up {args.db} ...")
+        Scheduler.login_throttle = LoginThrottle(args.login_rate, args.login_rate, args.login_rate, args.login_rate)
+        setup_database(args, dates)
+
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    processes = [
+        multiprocessing.Process(target=worker, args=(i, args, dates, start_at, results))
+        for i in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+
+    samples = []
+    stats = {"retries": 0, "give_ups": 0, "lock_wait_seconds": 0.0}
+    for _ in processes:
+        _, worker_samples, worker_stats = results.get()
+        samples.extend(worker_samples)
+        for key in stats:
+            stats[key] += worker_stats[key]
+    for p in processes:
+        p.join()
+
+    report(samples, stats, args.duration)
+
+    problems = check_consistency(args.db)
+    if len(problems) == 0:
+        print("Consistency check passed")
+        return 0
+    print("Consistency check FAILED")
+    for problem in problems:
+        print(problem)
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+from collections import deque
+
+
+'''
+Maximum matching of reservation requests to caregiver-days.
+
+A batch of requests is laid out as a flow network
+
+    source -> vaccine (capacity: doses on hand)
+           -> request (capacity: 1)
+           -> date    (capacity: free caregivers that day)
+           -> sink
+
+and a maximum flow gives the largest number of requests that can be booked
+without overdrawing any vaccine or date. Caregivers on the same date are
+interchangeable for the matching, so they are only assigned afterwards.
+'''
+
+
+class FlowNetwork:
+    # Dinic's algorithm over an adjacency list of [to, capacity, reverse index]
+
+    def __init__(self, size):
+        self.graph = [[] for _ in range(size)]
+
+    def add_edge(self, u, v, capacity):
+        self.graph[u].append([v, capacity, len(self.graph[v])])
+        self.graph[v].append([u, 0, len(self.graph[u]) - 1])
+        return len(self.graph[u]) - 1
+
+    def bfs_levels(self, source, sink):
+        level = [-1] * len(self.graph)
+        level[source] = 0
+        queue = deque([source])
+        while queue:
+            u = queue.popleft()
+            for v, capacity, _ in self.graph[u]:
+                if capacity > 0 and level[v] < 0:
+                    level[v] = level[u] + 1
+                    queue.append(v)
+        return level if level[sink] >= 0 else None
+
+    def augment(self, u, sink, pushed, level, next_edge):
+        if u == sink:
+            return pushed
+        edges = self.graph[u]
+        while next_edge[u] < len(edges):
+            edge = edges[next_edge[u]]
+            v, capacity, rev = edge
+            if capacity > 0 and level[v] == level[u] + 1:
+                flow = self.augment(v, sink, min(pushed, capacity), level, next_edge)
+                if flow > 0:
+                    edge[1] -= flow
+                    self.graph[v][rev][1] += flow
+                    return flow
+            next_edge[u] += 1
+        return 0
+
+    def max_flow(self, source, sink):
+        total = 0
+        while True:
+            level = self.bfs_levels(source, sink)
+            if level is None:
+                return total
+            next_edge = [0] * len(self.graph)
+            while True:
+                flow = self.augment(source, sink, float("inf"), level, next_edge)
+                if flow == 0:
+                    break
+                total += flow
+
+
+def match_requests(requests, doses, slots):
+    # requests: list of (vaccine, [acceptable dates in preference order])
+    # doses: vaccine -> doses on hand; slots: date -> free caregivers that day
+    # returns the matched date (or None) for every request, in request order
+    vaccines = sorted(doses)
+    dates = sorted(slots)
+    vaccine_node = {name: 1 + i for i, name in enumerate(vaccines)}
+    request_base = 1 + len(vaccines)
+    date_base = request_base + len(requests)
+    date_node = {date: date_base + i for i, date in enumerate(dates)}
+    sink = date_base + len(dates)
+
+    network = FlowNetwork(sink + 1)
+    for name in vaccines:
+        if doses[name] > 0:
+            network.add_edge(0, vaccine_node[name], doses[name])
+    for date in dates:
+        if slots[date] > 0:
+            network.add_edge(date_node[date], sink, slots[date])
+
+    # remember each request's candidate edges to read the matching back
+    candidates = []
+    for i, (vaccine, acceptable) in enumerate(requests):
+        node = request_base + i
+        edges = []
+        if vaccine in vaccine_node:
+            network.add_edge(vaccine_node[vaccine], node, 1)
+            for date in acceptable:
+                if date in date_node:
+                    edges.append((network.add_edge(node, date_node[date], 1), date))
+        candidates.append(edges)
+
+    network.max_flow(0, sink)
+
+    matched = []
+    for i, edges in enumerate(candidates):
+        node = request_base + i
+        date = None
+        for index, candidate in edges:
+            if network.graph[node][index][1] == 0:
+                date = candidate
+                break
+        matched.append(date)
+    return matched
@@ -0,0 +1,212 @@
+import sqlite3
+import threading
+
+
+'''
+Schema migrations for databases created from an older create.sql.
+
+create.sql builds a fresh database. A database that predates a feature is
+brought up to date the first time this process connects to it: missing tables
+and indexes are created, and missing columns are added with their defaults.
+Only the sqlite_master catalog is read when nothing is missing, so an up-to-date
+database never takes a write lock here. The same routine initialises the
+booking tables of a new, empty site file.
+'''
+
+# table -> CREATE statement, in dependency order
+TABLES = (
+    ("Sites", """
+        CREATE TABLE IF NOT EXISTS Sites (
+            Name varchar(255),
+            DBPath varchar(1024) NOT NULL,
+            Latitude REAL,
+            Longitude REAL,
+            Number INTEGER,
+            PRIMARY KEY (Name)
+        )
+    """),
+    ("Caregivers", """
+        CREATE TABLE IF NOT EXISTS Caregivers (
+            Username varchar(255),
+            Salt BINARY(16),
+            Hash BINARY(16),
+            Site varchar(255) REFERENCES Sites(Name),
+            PRIMARY KEY (Username)
+        )
+    """),
+    ("Shifts", """
+        CREATE TABLE IF NOT EXISTS Shifts (
+            Username varchar(255) REFERENCES Caregivers,
+            StartMinute int,
+            EndMinute int,
+            PRIMARY KEY (Username)
+        )
+    """),
+    ("Availabilities", """
+        CREATE TABLE IF NOT EXISTS Availabilities (
+            Time date,
+            Username varchar(255) REFERENCES Caregivers,
+            FreeSlots INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (Time, Username)
+        )
+    """),
+    ("Vaccines", """
+        CREATE TABLE IF NOT EXISTS Vaccines (
+            Name varchar(255),
+            Doses int,
+            PRIMARY KEY (Name)
+        )
+    """),
+    ("Restocks", """
+        CREATE TABLE IF NOT EXISTS Restocks (
+            Time date,
+            VaccineName varchar(255) REFERENCES Vaccines(Name),
+            Doses int
+        )
+    """),
+    ("Patients", """
+        CREATE TABLE IF NOT EXISTS Patients (
+            Username varchar(255),
+            Salt BINARY(16),
+            Hash BINARY(16),
+            PRIMARY KEY (Username)
+        )
+    """),
+    ("Appointments", """
+        CREATE TABLE IF NOT EXISTS Appointments (
+            AppointmentID INTEGER PRIMARY KEY,
+            Time date,
+            CaregiverUsername varchar(255),
+            PatientUsername varchar(255),
+            VaccineName varchar(255),
+            Slot int NOT NULL DEFAULT 0,
+            FOREIGN KEY (CaregiverUsername) REFERENCES Caregivers(Username),
+            FOREIGN KEY (PatientUsername)   REFERENCES Patients(Username),
+            FOREIGN KEY (VaccineName)       REFERENCES Vaccines(Name)
+        )
+    """),
+    ("AppointmentSequence", """
+        CREATE TABLE IF NOT EXISTS AppointmentSequence (
+            LastID INTEGER
+        )
+    """),
+    ("ArchiveState", """
+        CREATE TABLE IF NOT EXISTS ArchiveState (
+            Cutoff date
+        )
+    """),
+    ("ReminderState", """
+        CREATE TABLE IF NOT EXISTS ReminderState (
+            Watermark INTEGER,
+            WindowEnd date
+        )
+    """),
+    ("RequestKeys", """
+        CREATE TABLE IF NOT EXISTS RequestKeys (
+            Username varchar(255),
+            RequestKey varchar(255),
+            Operation varchar(32),
+            Result varchar(255),
+            CreatedAt REAL,
+            PRIMARY KEY (Username, RequestKey)
+        ) WITHOUT ROWID
+    """),
+    ("Events", """
+        CREATE TABLE IF NOT EXISTS Events (
+            Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            Kind varchar(32),
+            Payload TEXT,
+            CreatedAt REAL
+        )
+    """),
+    ("Holds", """
+        CREATE TABLE IF NOT EXISTS Holds (
+            HoldID INTEGER PRIMARY KEY AUTOINCREMENT,
+            Time date,
+            CaregiverUsername varchar(255) REFERENCES Caregivers,
+            PatientUsername varchar(255) REFERENCES Patients,
+            VaccineName varchar(255) REFERENCES Vaccines(Name),
+            Slot int NOT NULL DEFAULT 0,
+            ExpiresAt REAL NOT NULL
+        )
+    """),
+)
+
+# data a newly created table or column starts with, keyed by table or
+# "table.column"
+BACKFILLS = {
+    # IDs went up to the highest appointment, which was never archived
+    "AppointmentSequence": "INSERT INTO AppointmentSequence(LastID) SELECT MAX(AppointmentID) FROM Appointments",
+    # sites registered before they were numbered, in registration order
+    "Sites.Number": "UPDATE Sites SET Number = rowid WHERE Number IS NULL",
+}
+
+# columns added to tables that already existed, as (table, column, definition)
+COLUMNS = (
+    ("Sites", "Number", "Number INTEGER"),
+    ("Caregivers", "Site", "Site varchar(255) REFERENCES Sites(Name)"),
+    ("Availabilities", "FreeSlots", "FreeSlots INTEGER NOT NULL DEFAULT 1"),
+    ("Appointments", "Slot", "Slot int NOT NULL DEFAULT 0"),
+)
+
+INDEXES = (
+    ("RestocksByTime", "CREATE INDEX IF NOT EXISTS RestocksByTime ON Restocks(Time)"),
+    ("AppointmentsByTime",
+     "CREATE INDEX IF NOT EXISTS AppointmentsByTime ON Appointments(Time, CaregiverUsername, Slot)"),
+    ("RequestKeysByAge", "CREATE INDEX IF NOT EXISTS RequestKeysByAge ON RequestKeys(CreatedAt)"),
+    ("HoldsByExpiry", "CREATE INDEX IF NOT EXISTS HoldsByExpiry ON Holds(ExpiresAt)"),
+    ("SitesByNumber", "CREATE UNIQUE INDEX IF NOT EXISTS SitesByNumber ON Sites(Number)"),
+)
+
+# database paths already checked by this process
+migrated = set()
+
+migrated_lock = threading.Lock()
+
+
+def pending_statements(cursor):
+    # the DDL and backfills this database is missing, in order
+    cursor.execute("SELECT type, name FROM sqlite_master WHERE type IN ('table', 'index')")
+    existing = {row[1] for row in cursor.fetchall()}
+
+    statements = []
+    for name, ddl in TABLES:
+        if name not in existing:
+            statements.append(ddl)
+            if name in BACKFILLS:
+                statements.append(BACKFILLS[name])
+    for table, column, definition in COLUMNS:
+        if table in existing:
+            cursor.execute(f"PRAGMA table_info({table})")
+            if not any(row[1] == column for row in cursor.fetchall()):
+                statements.append(f"ALTER TABLE {table} ADD COLUMN {definition}")
+                if f"{table}.{column}" in BACKFILLS:
+                    statements.append(BACKFILLS[f"{table}.{column}"])
+    statements += [ddl for name, ddl in INDEXES if name not in existing]
+    return statements
+
+
+def migrate(conn):
+    # brings the database behind `conn` up to the current schema
+    cursor = conn.cursor()
+    if len(pending_statements(cursor)) == 0:
+        return
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        # another process may have upgraded the database while this one waited
+        # for the write lock, so the catalog is read again under it
+        for statement in pending_statements(cursor):
+            conn.execute(statement)
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+
+
+def ensure_schema(conn, db_path):
+    # migrates each database once per process
+    with migrated_lock:
+        if db_path in migrated:
+            return
+        migrate(conn)
+        migrated.add(db_path)
@@ -12,6 +12,8 @@ class Patient:
         self.password = password
         self.salt = salt
         self.hash = hash
+        # whether get() ran the password hash (only when the username exists)
+        self.hash_checked = False
 
     def get(self):
         cm = ConnectionManager()
@@ -25,6 +27,7 @@ class Patient:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
                 calculated_hash = Util.generate_hash(self.password, curr_salt)
+                self.hash_checked = True
                 if not curr_hash == calculated_hash:
                     # 密码不对
                     cm.close_connection()
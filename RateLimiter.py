@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+'''
+Token-bucket throttling for the login path.
+
+Each username gets a bucket of LOGIN_BURST tokens that refills at
+LOGIN_RATE_PER_MINUTE. Each client (a kiosk or host, shared by many users) gets
+a larger LOGIN_CLIENT_BURST bucket refilling at LOGIN_CLIENT_RATE_PER_MINUTE.
+Every login attempt takes a token, and an
+attempt that finds its bucket empty is rejected before any password hashing or
+database access. Buckets live in an LRU-ordered dict capped at
+LOGIN_MAX_BUCKETS entries. Buckets idle long enough to have refilled completely
+are dropped as well, because a full bucket carries no information.
+'''
+
+LOGIN_RATE_PER_MINUTE = float(os.getenv("LOGIN_RATE_PER_MINUTE", "10"))
+
+LOGIN_BURST = float(os.getenv("LOGIN_BURST", "5"))
+
+LOGIN_CLIENT_RATE_PER_MINUTE = float(os.getenv("LOGIN_CLIENT_RATE_PER_MINUTE", "60"))
+
+LOGIN_CLIENT_BURST = float(os.getenv("LOGIN_CLIENT_BURST", "20"))
+
+LOGIN_MAX_BUCKETS = int(os.getenv("LOGIN_MAX_BUCKETS", "10000"))
+
+
+class TokenBucketLimiter:
+
+    def __init__(self, rate_per_second, burst, max_buckets):
+        self.rate = rate_per_second
+        self.burst = burst
+        self.max_buckets = max_buckets
+        # key -> (tokens, last refill time), least recently used first
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def idle_expiry(self):
+        # seconds after which an untouched bucket is full again
+        return self.burst / self.rate if self.rate > 0 else float("inf")
+
+    def allow(self, key, now=None):
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            tokens, last = self.buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            self.evict(now)
+            return allowed
+
+    def evict(self, now):
+        # drop expired buckets from the old end, then enforce the size cap
+        expiry = self.idle_expiry()
+        while self.buckets:
+            key, (_, last) = next(iter(self.buckets.items()))
+            if now - last < expiry and len(self.buckets) <= self.max_buckets:
+                break
+            self.buckets.popitem(last=False)
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+class LoginThrottle:
+    # one limiter per username and one per client; an attempt needs both
+
+    def __init__(self, rate_per_minute=LOGIN_RATE_PER_MINUTE, burst=LOGIN_BURST,
+                 client_rate_per_minute=LOGIN_CLIENT_RATE_PER_MINUTE, client_burst=LOGIN_CLIENT_BURST,
+                 max_buckets=LOGIN_MAX_BUCKETS):
+        self.by_username = TokenBucketLimiter(rate_per_minute / 60.0, burst, max_buckets)
+        self.by_client = TokenBucketLimiter(client_rate_per_minute / 60.0, client_burst, max_buckets)
+        self.lock = threading.Lock()
+        self.attempts = 0
+        self.throttled = 0
+        self.hash_seconds = 0.0
+        self.hashes = 0
+
+    def allow(self, username, client):
+        allowed = self.by_client.allow(client) and self.by_username.allow(username)
+        with self.lock:
+            self.attempts += 1
+            if not allowed:
+                self.throttled += 1
+        return allowed
+
+    def record_hash_time(self, cpu_seconds):
+        with self.lock:
+            self.hash_seconds += cpu_seconds
+            self.hashes += 1
+
+    def get_metrics(self):
+        with self.lock:
+            average = self.hash_seconds / self.hashes if self.hashes else 0.0
+            return {
+                "attempts": self.attempts,
+                "throttled": self.throttled,
+                # every throttled attempt skipped one password hash
+                "cpu_seconds_saved": self.throttled * average,
+                "buckets": len(self.by_username) + len(self.by_client),
+            }
+
+
+login_throttle = LoginThrottle()
@@ -0,0 +1,140 @@
+import datetime
+import sqlite3
+import sys
+sys.path.append("../util/*")
+sys.path.append("../db/*")
+from util.Slots import slots_enabled, slot_label_sql
+from util.Export import write_rows
+from db.ConnectionManager import ConnectionManager
+from db.Transaction import run_transaction
+
+
+'''
+Incremental appointment reminders.
+
+A run covers the appointments dated in the next N days, starting today. The
+first run emits a "send" record for every one of them. ReminderState then
+remembers the Events sequence number the run read up to (the watermark) and
+how far ahead it looked (WindowEnd), so the next run only emits:
+
+- "send" for appointments on days the previous run did not cover yet,
+- "send" for appointments booked or reassigned since the watermark,
+- "cancel" for appointments canceled since the watermark.
+
+Consumers key records on appointment_id; a later "send" replaces an earlier
+one. Every part is a range scan (Appointments through AppointmentsByTime,
+Events through its Seq key) that streams into the output file in fetchmany()
+batches, so memory stays bounded however many appointments are due. If the
+events after the watermark were already compacted away the run falls back to
+a full window.
+'''
+
+# event kinds that create, move or remove an appointment
+APPOINTMENT_EVENT_KINDS = ("reserve", "reassign", "cancel")
+
+REMINDER_COLUMNS = ("action", "appointment_id", "date", "slot", "patient", "caregiver", "vaccine")
+
+
+def get_reminder_state(cursor):
+    cursor.execute("SELECT Watermark, WindowEnd FROM ReminderState")
+    row = cursor.fetchone()
+    if row is None:
+        return None, None
+    return row[0], row[1]
+
+
+def events_complete_since(cursor, watermark):
+    # sequence numbers are never reused or skipped, so a gap right after the
+    # watermark means compaction dropped events this job never saw
+    cursor.execute("SELECT MIN(Seq) FROM Events WHERE Seq > ?", (watermark,))
+    first = cursor.fetchone()[0]
+    if first is not None:
+        return first == watermark + 1
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'Events'")
+    row = cursor.fetchone()
+    return row is None or row[0] <= watermark
+
+
+def generate_reminders(out, days, fmt="jsonl", site=None, today=None, progress=None):
+    # writes the reminder records for the next `days` days to `out`; returns
+    # (records written, whether this was a full run) after advancing the
+    # watermark, which only happens once every record was written
+    today = today or datetime.date.today()
+    start = today.strftime("%Y-%m-%d")
+    end = (today + datetime.timedelta(days=days)).strftime("%Y-%m-%d")
+
+    cm = ConnectionManager(site)
+    conn = cm.create_connection()
+    # plain tuples are cheaper than sqlite3.Row when streaming millions of rows
+    conn.row_factory = None
+    cursor = conn.cursor()
+    try:
+        # one read transaction, so the watermark matches the rows emitted
+        cursor.execute("BEGIN")
+        watermark, window_end = get_reminder_state(cursor)
+        cursor.execute("SELECT COALESCE(MAX(Seq), 0) FROM Events")
+        upto = cursor.fetchone()[0]
+        full = watermark is None or not events_complete_since(cursor, watermark)
+
+        # appointments touched since the watermark, latest event per appointment,
+        # extracted set-based straight from the feed's Seq range
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS ReminderChanges (
+                AppointmentID INTEGER PRIMARY KEY,
+                Time date,
+                PatientUsername varchar(255),
+                CaregiverUsername varchar(255)
+            )
+        """)
+        cursor.execute("DELETE FROM temp.ReminderChanges")
+        if not full:
+            kinds = ", ".join("?" for _ in APPOINTMENT_EVENT_KINDS)
+            cursor.execute(f"""
+                INSERT OR REPLACE INTO temp.ReminderChanges
+                SELECT json_extract(Payload, '$.appointment_id'), json_extract(Payload, '$.date'),
+                       json_extract(Payload, '$.patient'), json_extract(Payload, '$.caregiver')
+                FROM Events
+                WHERE Seq > ? AND Seq <= ? AND Kind IN ({kinds})
+                ORDER BY Seq ASC
+            """, (watermark, upto) + APPOINTMENT_EVENT_KINDS)
+
+        # days already covered by the previous run only need their changes;
+        # a full run treats the whole window as new
+        covered_end = start if full else max(start, min(window_end, end))
+        slot_column = slot_label_sql("a.Slot") if slots_enabled() else "NULL"
+        query = f"""
+            SELECT 'cancel', c.AppointmentID, c.Time, NULL, c.PatientUsername, c.CaregiverUsername, NULL
+            FROM temp.ReminderChanges c
+            WHERE c.Time >= ? AND c.Time < ?
+              AND NOT EXISTS (SELECT 1 FROM Appointments a WHERE a.AppointmentID = c.AppointmentID)
+            UNION ALL
+            SELECT 'send', a.AppointmentID, a.Time, {slot_column}, a.PatientUsername, a.CaregiverUsername,
+                   a.VaccineName
+            FROM temp.ReminderChanges c
+            JOIN Appointments a ON a.AppointmentID = c.AppointmentID
+            WHERE a.Time >= ? AND a.Time < ?
+            UNION ALL
+            SELECT 'send', a.AppointmentID, a.Time, {slot_column}, a.PatientUsername, a.CaregiverUsername,
+                   a.VaccineName
+            FROM Appointments a
+            WHERE a.Time >= ? AND a.Time < ?
+        """
+        cursor.execute(query, (start, covered_end, start, covered_end, covered_end, end))
+        count = write_rows(cursor, out, fmt, columns=REMINDER_COLUMNS, progress=progress)
+        out.flush()
+        conn.rollback()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        cm.close_connection()
+
+    # advance the watermark only after the output is safely written
+    new_window_end = end if full else max(window_end, end)
+
+    def unit(cursor):
+        cursor.execute("DELETE FROM ReminderState")
+        cursor.execute("INSERT INTO ReminderState(Watermark, WindowEnd) VALUES (?, ?)", (upto, new_window_end))
+
+    run_transaction(unit, site=site)
+    return count, full
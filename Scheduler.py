@@ -1,10 +1,32 @@
 from model.Vaccine import Vaccine
 from model.Caregiver import Caregiver
 from model.Patient import Patient
+from model.BookingWindow import BookingWindow
+from model.Holds import HOLD_TTL_SECONDS, get_hold_expiry, reclaim_expired_holds, release_holds
 from util.Util import Util
+from util.Analytics import ROLLING_WINDOW, day_range, densify, rolling_mean, ratios, stock_out_forecast
+from util.Slots import (
+    slots_enabled, slot_bit, first_free_slot, free_slot_count, slot_label, slot_label_sql, slot_for_clock,
+    parse_clock, shift_bitmap,
+)
+from util.RateLimiter import login_throttle
+from util.Export import EXPORT_FORMATS, open_export_file, write_rows
 from db.ConnectionManager import ConnectionManager
+from db.Sites import list_sites, site_exists, register_site, nearest_site
+from db.AppointmentIds import get_id_base, next_appointment_ids, get_appointment_site
+from db.Backend import shutdown_backends
+from db.Transaction import run_transaction, get_transaction_stats
+from db.Idempotency import idempotent
+from db.Events import append_event, append_events, changes_since, compact_events
+from db.Archive import appointments_source, archive_appointments_before
+from db.Reminders import generate_reminders
+from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 import datetime
+import json
+import os
+import socket
+import time
 
 
 '''
@@ -16,6 +38,14 @@ current_patient = None
 
 current_caregiver = None
 
+# site whose booking data the current user works with: a caregiver's own site,
+# or the one a patient picked with select_site; None is the default site
+current_site = None
+
+# who is logging in, for per-client login throttling; a server embedding these
+# commands sets this per request
+client_id = os.getenv("SCHEDULER_CLIENT_ID", socket.gethostname())
+
 
 def is_strong_password(password):
     # 8+ characters
@@ -77,14 +107,22 @@ def create_patient(tokens):
 
 
 def create_caregiver(tokens):
-    # create_caregiver <username> <password>
-    # check 1: the length for tokens need to be exactly 3 to include all information (with the operation name)
-    if len(tokens) != 3:
+    # create_caregiver <username> <password> [<site>]
+    # check 1: the length for tokens need to be 3, or 4 with the caregiver's site
+    if len(tokens) != 3 and len(tokens) != 4:
         print("Failed to create user.")
         return
 
     username = tokens[1]
     password = tokens[2]
+    site = tokens[3] if len(tokens) == 4 else None
+    try:
+        if site is not None and not site_exists(site):
+            print("Unknown site, try again!")
+            return
+    except sqlite3.Error as e:
+        print("Failed to create user.", e)
+        return
     # check 2: check if the username has been taken already
     if username_exists_caregiver(username):
         print("Username taken, try again!")
@@ -101,7 +139,7 @@ def create_caregiver(tokens):
     hash = Util.generate_hash(password, salt)
 
     # create the caregiver
-    caregiver = Caregiver(username, salt=salt, hash=hash)
+    caregiver = Caregiver(username, salt=salt, hash=hash, site=site)
 
     # save to caregiver information to our database
     try:
@@ -160,6 +198,25 @@ def username_exists_caregiver(username):
     return False
 
 
+def existing_patients(usernames):
+    # the subset of `usernames` that are registered patients
+    usernames = list(usernames)
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    found = set()
+    try:
+        # chunked to stay under SQLite's bound parameter limit
+        for i in range(0, len(usernames), 500):
+            chunk = usernames[i:i + 500]
+            placeholders = ", ".join("?" for _ in chunk)
+            cursor.execute(f"SELECT Username FROM Patients WHERE Username IN ({placeholders})", chunk)
+            found.update(row["Username"] for row in cursor)
+    finally:
+        cm.close_connection()
+    return found
+
+
 def login_patient(tokens):
     # login_patient <username> <password>
 
@@ -178,10 +235,20 @@ def login_patient(tokens):
     username = tokens[1]
     password = tokens[2]
 
+    # Check 3: over-limit attempts are turned away before any hashing or DB access
+    if not login_throttle.allow(username, client_id):
+        print("Too many login attempts, please try again later")
+        return
+
     patient = None
     try:
         # Retrieve patient info and verify password
-        patient = Patient(username, password=password).get()
+        started = time.process_time()
+        account = Patient(username, password=password)
+        patient = account.get()
+        # unknown usernames skip the hash, so they say nothing about its cost
+        if account.hash_checked:
+            login_throttle.record_hash_time(time.process_time() - started)
     except sqlite3.Error:
         print("Login patient failed")
         return
@@ -200,7 +267,7 @@ def login_patient(tokens):
 def login_caregiver(tokens):
     # login_caregiver <username> <password>
     # check 1: if someone's already logged-in, they need to log out first
-    global current_caregiver
+    global current_caregiver, current_site
     if current_caregiver is not None or current_patient is not None:
         print("User already logged in.")
         return
@@ -213,9 +280,19 @@ def login_caregiver(tokens):
     username = tokens[1]
     password = tokens[2]
 
+    # check 3: over-limit attempts are turned away before any hashing or DB access
+    if not login_throttle.allow(username, client_id):
+        print("Too many login attempts, please try again later")
+        return
+
     caregiver = None
     try:
-        caregiver = Caregiver(username, password=password).get()
+        started = time.process_time()
+        account = Caregiver(username, password=password)
+        caregiver = account.get()
+        # unknown usernames skip the hash, so they say nothing about its cost
+        if account.hash_checked:
+            login_throttle.record_hash_time(time.process_time() - started)
     except sqlite3.Error as e:
         print("Login failed.", e)
         return
@@ -229,10 +306,47 @@ def login_caregiver(tokens):
     else:
         print("Logged in as: " + username)
         current_caregiver = caregiver
+        current_site = caregiver.get_site()
+
+
+def read_site_schedule(site, date):
+    # (caregivers with a free slot that date, vaccine stock) of one site, as
+    # lists of (username, free_slots) and (name, doses)
+    cm = ConnectionManager(site)
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+    try:
+        # Query available caregivers for the given date, ordered by username
+        get_caregivers = """
+            SELECT Username, FreeSlots
+            FROM Availabilities
+            WHERE date(Time) = date(?) AND FreeSlots != 0
+            ORDER BY Username ASC
+        """
+        cursor.execute(get_caregivers, (date,))
+        caregivers = [(row["Username"], row["FreeSlots"]) for row in cursor]
+
+        # Query all vaccines and their remaining doses, ordered by name
+        get_vaccines = """
+            SELECT Name, Doses
+            FROM Vaccines
+            ORDER BY Name ASC
+        """
+        cursor.execute(get_vaccines)
+        vaccines = [(row["Name"], row["Doses"]) for row in cursor]
+        return caregivers, vaccines
+    finally:
+        cm.close_connection()
+
+
+def reclaim_and_read_schedule(site, date):
+    # expired holds are released first, so their slots and doses show up again
+    reclaim_expired_holds(site)
+    return read_site_schedule(site, date)
 
 
 def search_caregiver_schedule(tokens):
-    # search_caregiver_schedule <date>
+    # search_caregiver_schedule <date> [--all-sites]
 
     global current_caregiver, current_patient
 
@@ -242,68 +356,190 @@ def search_caregiver_schedule(tokens):
         return
 
     # Check 2: command format
-    if len(tokens) != 2:
+    if len(tokens) != 2 and not (len(tokens) == 3 and tokens[2] == "--all-sites"):
         print("Please try again")
         return
 
     date = tokens[1]
+    all_sites = len(tokens) == 3
 
     try:
         datetime.datetime.strptime(date, "%Y-%m-%d")
     except ValueError:
         print("Please try again")
         return
-    
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
 
     try:
-        # Query available caregivers for the given date, ordered by username
-        get_caregivers = """
-            SELECT Username
-            FROM Availabilities
-            WHERE date(Time) = date(?)
-            ORDER BY Username ASC
-        """
-        cursor.execute(get_caregivers, (date,))
-        caregivers = [row["Username"] for row in cursor]
+        if all_sites:
+            # every site is read concurrently from its own file, then merged;
+            # the default site (None) holds the data of caregivers without a site
+            sites = [None] + list_sites()
+            with ThreadPoolExecutor(max_workers=len(sites)) as pool:
+                results = list(pool.map(lambda site: reclaim_and_read_schedule(site, date), sites))
+            caregivers = sorted(
+                (name, free_slots, site or "default")
+                for site, (site_caregivers, _) in zip(sites, results)
+                for name, free_slots in site_caregivers
+            )
+            vaccines = sorted(
+                (name, doses, site or "default")
+                for site, (_, site_vaccines) in zip(sites, results)
+                for name, doses in site_vaccines
+            )
+        else:
+            caregivers, vaccines = reclaim_and_read_schedule(current_site, date)
+            caregivers = [(name, free_slots, None) for name, free_slots in caregivers]
+            vaccines = [(name, doses, None) for name, doses in vaccines]
 
         print("Caregivers:")
         if len(caregivers) == 0:
             print("No caregivers available")
         else:
-            for name in caregivers:
-                print(name)
-
-        # Query all vaccines and their remaining doses, ordered by name
-        get_vaccines = """
-            SELECT Name, Doses
-            FROM Vaccines
-            ORDER BY Name ASC
-        """
-        cursor.execute(get_vaccines)
-        vaccines = cursor.fetchall()
+            for name, free_slots, site in caregivers:
+                line = name if site is None else f"{name} {site}"
+                if slots_enabled():
+                    # slot mode also shows how much of the shift is left
+                    first = slot_label(first_free_slot(free_slots))
+                    print(f"{line} {free_slot_count(free_slots)} slots free, first {first}")
+                else:
+                    print(line)
 
         print("Vaccines:")
         if len(vaccines) == 0:
             print("No vaccines available")
         else:
-            for row in vaccines:
-                name = row["Name"]
-                doses = row["Doses"]
-                print(f"{name} {doses}")
+            for name, doses, site in vaccines:
+                if site is None:
+                    print(f"{name} {doses}")
+                else:
+                    print(f"{name} {doses} {site}")
 
     except sqlite3.Error:
         print("Please try again")
     except Exception:
         print("Please try again")
-    finally:
-        cm.close_connection()
+
+
+def select_site(tokens):
+    # select_site <site> | select_site nearest <latitude> <longitude>
+    global current_site
+
+    # check 1: patients pick where to book; caregivers always work at their own site
+    if current_patient is None:
+        print("Please login as a patient first!")
+        return
+
+    try:
+        if len(tokens) == 2:
+            site = tokens[1]
+            if not site_exists(site):
+                print("Unknown site, try again!")
+                return
+        elif len(tokens) == 4 and tokens[1] == "nearest":
+            site = nearest_site(float(tokens[2]), float(tokens[3]))
+            if site is None:
+                print("No sites available")
+                return
+        else:
+            print("Please try again!")
+            return
+    except ValueError:
+        print("Please try again!")
+        return
+    except sqlite3.Error as e:
+        print("Selecting site failed", e)
+        return
+
+    current_site = site
+    print("Selected site", site)
+
+
+def create_site(tokens):
+    # create_site <name> <db_path> <latitude> <longitude>
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 5:
+        print("Please try again!")
+        return
+
+    try:
+        latitude = float(tokens[3])
+        longitude = float(tokens[4])
+    except ValueError:
+        print("Please try again!")
+        return
+
+    try:
+        if site_exists(tokens[1]):
+            print("Site already exists, try again!")
+            return
+        register_site(tokens[1], tokens[2], latitude, longitude)
+    except ValueError as e:
+        print("Creating site failed", e)
+        return
+    except OSError as e:
+        print("Creating site failed", e)
+        return
+    except sqlite3.Error as e:
+        print("Creating site failed", e)
+        return
+    print("Created site", tokens[1])
+
+
+def parse_options(tokens, base_length, names):
+    # trailing "--name value" options after the positional tokens, e.g.
+    # "--key <request_key>" for safe client retries; returns a dict of the
+    # options given, or None if the tokens do not parse
+    options = {}
+    rest = tokens[base_length:]
+    if len(tokens) < base_length or len(rest) % 2 != 0:
+        return None
+    for i in range(0, len(rest), 2):
+        name = rest[i][2:] if rest[i].startswith("--") else None
+        if name not in names or name in options:
+            return None
+        options[name] = rest[i + 1]
+    return options
+
+
+def pick_caregiver(cursor, date, wanted_slot=None):
+    # (availability rowid, caregiver, slot) of the first caregiver, alphabetically,
+    # with a free slot that date: their earliest one, or `wanted_slot`; None if
+    # nobody is free
+    get_caregivers = """
+        SELECT rowid AS RowID, Username, FreeSlots
+        FROM Availabilities
+        WHERE date(Time) = date(?) AND FreeSlots != 0
+        ORDER BY Username ASC
+    """
+    cursor.execute(get_caregivers, (date,))
+    for row in cursor.fetchall():
+        if wanted_slot is None:
+            return row["RowID"], row["Username"], first_free_slot(row["FreeSlots"])
+        if row["FreeSlots"] & slot_bit(wanted_slot):
+            return row["RowID"], row["Username"], wanted_slot
+    return None
+
+
+def take_slot(cursor, availability_rowid, slot):
+    # a day with no free slot left is removed, as a whole-day booking always is
+    take = "UPDATE Availabilities SET FreeSlots = FreeSlots & ~? WHERE rowid = ?"
+    cursor.execute(take, (slot_bit(slot), availability_rowid))
+    delete_availability = "DELETE FROM Availabilities WHERE rowid = ? AND FreeSlots = 0"
+    cursor.execute(delete_availability, (availability_rowid,))
+
+
+def booking_message(appointment_id, caregiver, slot):
+    if slots_enabled():
+        return f"Appointment ID {appointment_id}, Caregiver username {caregiver}, Slot {slot_label(slot)}"
+    return f"Appointment ID {appointment_id}, Caregiver username {caregiver}"
 
 
 def reserve(tokens):
-    # reserve <date> <vaccine>
+    # reserve <date> <vaccine> [--at <HH:MM>] [--key <request_key>]
 
     global current_caregiver, current_patient
 
@@ -318,34 +554,35 @@ def reserve(tokens):
         return
 
     # Check 3: command format
-    if len(tokens) != 3:
+    options = parse_options(tokens, 3, ("at", "key"))
+    if options is None:
         print("Please try again")
         return
+    request_key = options.get("key")
+
+    # Check 4: a requested start time must be a slot boundary
+    wanted_slot = None
+    if "at" in options:
+        try:
+            wanted_slot = slot_for_clock(options["at"])
+        except ValueError:
+            print("Please try again")
+            return
 
     date = tokens[1]
     vaccine_name = tokens[2]
+    patient_username = current_patient.get_username()
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
+    # The whole reservation is one write unit: on lock contention it is rolled
+    # back and re-run from step 1, so it never books from a stale read.
+    def unit(cursor):
+        # 1) Find the first caregiver (alphabetically) with a free slot that date,
+        #    and take their earliest free slot (or the requested one)
+        chosen = pick_caregiver(cursor, date, wanted_slot)
+        if chosen is None:
+            return "No caregiver is available"
 
-    try:
-        # 1) Find available caregivers for the given date (ordered alphabetically)
-        get_caregivers = """
-            SELECT Username
-            FROM Availabilities
-            WHERE date(Time) = date(?)
-            ORDER BY Username ASC
-        """
-        cursor.execute(get_caregivers, (date,))
-        caregivers = [row["Username"] for row in cursor]
-
-        if len(caregivers) == 0:
-            print("No caregiver is available")
-            cm.close_connection()
-            return
-
-        chosen_caregiver = caregivers[0]
+        availability_rowid, chosen_caregiver, slot = chosen
 
         # 2) Check vaccine doses
         get_doses = """
@@ -356,38 +593,25 @@ def reserve(tokens):
         cursor.execute(get_doses, (vaccine_name,))
         row = cursor.fetchone()
         if row is None or row["Doses"] is None or row["Doses"] <= 0:
-            print("Not enough available doses")
-            cm.close_connection()
-            return
+            return "Not enough available doses"
 
         current_doses = row["Doses"]
 
-        # 3) Determine next AppointmentID (start from 1, increment by 1)
-        get_max_id = "SELECT MAX(AppointmentID) AS MaxID FROM Appointments"
-        cursor.execute(get_max_id)
-        row = cursor.fetchone()
-        if row is None or row["MaxID"] is None:
-            next_id = 1
-        else:
-            next_id = row["MaxID"] + 1
+        # 3) Take the site's next AppointmentID
+        next_id = next_appointment_ids(cursor, id_base)[0]
 
         # 4) Insert into Appointments
         insert_appointment = """
-            INSERT INTO Appointments(AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName)
-            VALUES (?, ?, ?, ?, ?)
+            INSERT INTO Appointments(AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot)
+            VALUES (?, ?, ?, ?, ?, ?)
         """
-        patient_username = current_patient.get_username()
         cursor.execute(
             insert_appointment,
-            (next_id, date, chosen_caregiver, patient_username, vaccine_name),
+            (next_id, date, chosen_caregiver, patient_username, vaccine_name, slot),
         )
 
-        # 5) Remove caregiver availability for that date
-        delete_availability = """
-            DELETE FROM Availabilities
-            WHERE date(Time) = date(?) AND Username = ?
-        """
-        cursor.execute(delete_availability, (date, chosen_caregiver))
+        # 5) Take the slot out of the caregiver's availability
+        take_slot(cursor, availability_rowid, slot)
 
         # 6) Decrease vaccine doses by 1
         update_vaccine = """
@@ -397,18 +621,247 @@ def reserve(tokens):
         """
         cursor.execute(update_vaccine, (current_doses - 1, vaccine_name))
 
-        # 7) Commit all changes
-        conn.commit()
+        # 7) Publish the booking to the change feed
+        append_event(cursor, "reserve", appointment_id=next_id, date=date, caregiver=chosen_caregiver,
+                     patient=patient_username, vaccine=vaccine_name, slot=slot)
 
-        # 8) Print confirmation
-        print(f"Appointment ID {next_id}, Caregiver username {chosen_caregiver}")
+        return booking_message(next_id, chosen_caregiver, slot)
 
+    try:
+        # expired holds go back into the pool before looking for a caregiver
+        reclaim_expired_holds(current_site)
+        id_base = get_id_base(current_site)
+        # 8) Run (and if needed retry) the unit, then print the outcome; a repeated
+        #    request key replays the recorded outcome instead of booking again
+        print(run_transaction(idempotent(unit, patient_username, request_key, "reserve"), site=current_site))
     except sqlite3.Error:
         print("Please try again")
     except Exception:
         print("Please try again")
-    finally:
-        cm.close_connection()
+
+
+def hold(tokens):
+    # hold <date> <vaccine> [--at <HH:MM>] [--key <request_key>]
+    # Like reserve, but the caregiver slot and dose are only held for
+    # HOLD_TTL_SECONDS; confirm <hold_id> turns the hold into an appointment,
+    # otherwise both go back to the pool when it expires.
+
+    global current_caregiver, current_patient
+
+    # Check 1: someone must be logged in
+    if current_caregiver is None and current_patient is None:
+        print("Please login first")
+        return
+
+    # Check 2: the current user must be a patient
+    if current_caregiver is not None:
+        print("Please login as a patient")
+        return
+
+    # Check 3: command format
+    options = parse_options(tokens, 3, ("at", "key"))
+    if options is None:
+        print("Please try again")
+        return
+    request_key = options.get("key")
+
+    # Check 4: a requested start time must be a slot boundary
+    wanted_slot = None
+    if "at" in options:
+        try:
+            wanted_slot = slot_for_clock(options["at"])
+        except ValueError:
+            print("Please try again")
+            return
+
+    date = tokens[1]
+    vaccine_name = tokens[2]
+    patient_username = current_patient.get_username()
+    placed = []
+
+    def unit(cursor):
+        # 1) Same caregiver choice as reserve
+        chosen = pick_caregiver(cursor, date, wanted_slot)
+        if chosen is None:
+            return "No caregiver is available"
+        availability_rowid, chosen_caregiver, slot = chosen
+
+        # 2) Take a dose, if there is one left
+        take_dose = "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = ? AND Doses > 0"
+        cursor.execute(take_dose, (vaccine_name,))
+        if cursor.rowcount == 0:
+            return "Not enough available doses"
+
+        # 3) Take the slot, so other searches and reserves no longer see it
+        take_slot(cursor, availability_rowid, slot)
+
+        # 4) Record the hold with its expiry
+        expires_at = time.time() + HOLD_TTL_SECONDS
+        add_hold = """
+            INSERT INTO Holds(Time, CaregiverUsername, PatientUsername, VaccineName, Slot, ExpiresAt)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        cursor.execute(add_hold, (date, chosen_caregiver, patient_username, vaccine_name, slot, expires_at))
+        hold_id = cursor.lastrowid
+        append_event(cursor, "hold", hold_id=hold_id, date=date, caregiver=chosen_caregiver,
+                     patient=patient_username, vaccine=vaccine_name, slot=slot)
+
+        # a retried attempt starts over, so only the committed one is kept
+        placed[:] = [(hold_id, expires_at)]
+        message = f"Hold ID {hold_id}, Caregiver username {chosen_caregiver}"
+        if slots_enabled():
+            message += f", Slot {slot_label(slot)}"
+        return message + f", expires in {HOLD_TTL_SECONDS:g} seconds"
+
+    try:
+        reclaim_expired_holds(current_site)
+        result = run_transaction(idempotent(unit, patient_username, request_key, "hold"), site=current_site)
+        # the expiry heap only learns about holds once they are committed
+        for hold_id, expires_at in placed:
+            get_hold_expiry(current_site).add(hold_id, expires_at)
+        print(result)
+    except sqlite3.Error:
+        print("Please try again")
+    except Exception:
+        print("Please try again")
+
+
+def confirm(tokens):
+    # confirm <hold_id>
+    global current_caregiver, current_patient
+
+    # Check 1: only the patient who placed the hold confirms it
+    if current_patient is None:
+        print("Please login as a patient")
+        return
+
+    # Check 2: command format
+    if len(tokens) != 2:
+        print("Please try again")
+        return
+    try:
+        hold_id = int(tokens[1])
+    except ValueError:
+        print("Please try again")
+        return
+
+    patient_username = current_patient.get_username()
+
+    def unit(cursor):
+        get_hold = """
+            SELECT HoldID, Time, CaregiverUsername, VaccineName, Slot, ExpiresAt
+            FROM Holds
+            WHERE HoldID = ? AND PatientUsername = ?
+        """
+        cursor.execute(get_hold, (hold_id, patient_username))
+        row = cursor.fetchone()
+        if row is None:
+            return f"Hold ID {hold_id} does not exist"
+
+        # a hold past its TTL is released here even if no reclaim ran yet
+        if row["ExpiresAt"] <= time.time():
+            release_holds(cursor, [hold_id], "hold_expired")
+            return f"Hold ID {hold_id} has expired"
+
+        # the slot and dose were taken when the hold was placed, so booking
+        # only records the appointment and drops the hold
+        next_id = next_appointment_ids(cursor, id_base)[0]
+        insert_appointment = """
+            INSERT INTO Appointments(AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        cursor.execute(
+            insert_appointment,
+            (next_id, row["Time"], row["CaregiverUsername"], patient_username, row["VaccineName"], row["Slot"]),
+        )
+        cursor.execute("DELETE FROM Holds WHERE HoldID = ?", (hold_id,))
+        append_event(cursor, "reserve", appointment_id=next_id, date=row["Time"],
+                     caregiver=row["CaregiverUsername"], patient=patient_username, vaccine=row["VaccineName"],
+                     slot=row["Slot"], hold_id=hold_id)
+        return booking_message(next_id, row["CaregiverUsername"], row["Slot"])
+
+    try:
+        id_base = get_id_base(current_site)
+        print(run_transaction(unit, site=current_site))
+    except sqlite3.Error:
+        print("Please try again")
+    except Exception:
+        print("Please try again")
+
+
+def batch_reserve(tokens):
+    # batch_reserve <file>
+    # each line of the file: <patient> <vaccine> <date>[,<date>...]
+    # check 1: batches are submitted by staff
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: the length for tokens need to be exactly 2 to include the file
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    lines = []
+    try:
+        with open(tokens[1]) as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) == 0:
+                    continue
+                if len(fields) != 3:
+                    raise ValueError("Bad request line: " + line.strip())
+                dates = [
+                    datetime.datetime.strptime(d, "%Y-%m-%d").strftime("%Y-%m-%d")
+                    for d in fields[2].split(",")
+                ]
+                lines.append((fields[0], fields[1], dates))
+    except OSError as e:
+        print("Batch reserve failed", e)
+        return
+    except ValueError as e:
+        print("Batch reserve failed", e)
+        return
+
+    # check 3: only requests for existing patients are booked
+    try:
+        known = existing_patients({patient for patient, _, _ in lines})
+    except sqlite3.Error as e:
+        print("Batch reserve failed", e)
+        return
+
+    window = BookingWindow(site=current_site)
+    for patient, vaccine, dates in lines:
+        if patient in known:
+            window.submit(patient, vaccine, dates)
+        else:
+            print(f"{patient}: Unknown patient")
+
+    requests = window.pending()
+    try:
+        reclaim_expired_holds(current_site)
+        results = window.flush()
+    except sqlite3.Error as e:
+        print("Batch reserve failed", e)
+        return
+    except Exception as e:
+        print("Batch reserve failed", e)
+        return
+
+    booked = 0
+    for (patient, _, _), result in zip(requests, results):
+        if result is None:
+            print(f"{patient}: No caregiver is available")
+        else:
+            booked += 1
+            appt_id, caregiver, date, slot = result
+            if slots_enabled():
+                print(f"{patient}: Appointment ID {appt_id}, Caregiver username {caregiver}, Date {date}, "
+                      f"Slot {slot_label(slot)}")
+            else:
+                print(f"{patient}: Appointment ID {appt_id}, Caregiver username {caregiver}, Date {date}")
+    print(f"Booked {booked} of {len(lines)} requests")
 
 
 def upload_availability(tokens):
@@ -445,8 +898,91 @@ def upload_availability(tokens):
     print("Availability uploaded!")
 
 
+def sync_availability(tokens):
+    # sync_availability <file>
+    # the file lists every date (yyyy-mm-dd, one per line) the caregiver wants
+    # to be available on, from today on
+    # check 1: caregivers sync their own calendar
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: the length for tokens need to be exactly 2 to include the file
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        with open(tokens[1]) as f:
+            days = {
+                datetime.datetime.strptime(line.strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+                for line in f if line.strip()
+            }
+    except OSError as e:
+        print("Sync availability failed", e)
+        return
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    try:
+        # an expired hold no longer books its day, so it must not block removing it
+        reclaim_expired_holds(current_site)
+        changes = current_caregiver.sync_availability(days, datetime.date.today().strftime("%Y-%m-%d"))
+    except sqlite3.Error as e:
+        print("Sync availability failed", e)
+        return
+    except Exception as e:
+        print("Sync availability failed", e)
+        return
+
+    added = [day for day, action in changes if action == "added"]
+    removed = [day for day, action in changes if action == "removed"]
+    conflicts = [day for day, action in changes if action == "conflict"]
+    print(f"Synced availability: {len(added)} added, {len(removed)} removed, {len(conflicts)} conflicting")
+    for day in added:
+        print(f"Added {day}")
+    for day in removed:
+        print(f"Removed {day}")
+    for day in conflicts:
+        print(f"Kept {day}: appointments are booked that day")
+
+
+def set_shift(tokens):
+    #  set_shift <HH:MM> <HH:MM>
+    #  check 1: check if the current logged-in user is a caregiver
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    #  check 2: the length for tokens need to be exactly 3 to include both times
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+
+    try:
+        start_minute = parse_clock(tokens[1])
+        end_minute = parse_clock(tokens[2])
+    except ValueError:
+        print("Please enter a valid time!")
+        return
+    # the shift has to hold at least one slot
+    if shift_bitmap(start_minute, end_minute) == 0:
+        print("Please enter a valid time!")
+        return
+
+    try:
+        current_caregiver.set_shift(start_minute, end_minute)
+    except sqlite3.Error as e:
+        print("Setting shift failed", e)
+        return
+    print(f"Shift set to {tokens[1]}-{tokens[2]}")
+
+
 def cancel(tokens):
-    # cancel <appointment_id>
+    # cancel <appointment_id> [--key <request_key>]
     global current_caregiver, current_patient
 
     # Must be logged in
@@ -454,10 +990,12 @@ def cancel(tokens):
         print("Please login first")
         return
 
-    # Format: cancel <appointment_id>
-    if len(tokens) != 2:
+    # Format: cancel <appointment_id> [--key <request_key>]
+    options = parse_options(tokens, 2, ("key",))
+    if options is None:
         print("Please try again")
         return
+    request_key = options.get("key")
 
     # Parse ID
     try:
@@ -466,47 +1004,52 @@ def cancel(tokens):
         print("Please try again")
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
+    # Decide who is logged in
+    if current_caregiver is not None:
+        username = current_caregiver.get_username()
+        query = """
+            SELECT AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot
+            FROM Appointments
+            WHERE AppointmentID = ? AND CaregiverUsername = ?
+        """
+    else:
+        username = current_patient.get_username()
+        query = """
+            SELECT AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName, Slot
+            FROM Appointments
+            WHERE AppointmentID = ? AND PatientUsername = ?
+        """
 
-    try:
-        # Decide who is logged in
-        if current_caregiver is not None:
-            username = current_caregiver.get_username()
-            query = """
-                SELECT AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName
-                FROM Appointments
-                WHERE AppointmentID = ? AND CaregiverUsername = ?
-            """
-            cursor.execute(query, (appt_id, username))
-        else:
-            username = current_patient.get_username()
-            query = """
-                SELECT AppointmentID, Time, CaregiverUsername, PatientUsername, VaccineName
-                FROM Appointments
-                WHERE AppointmentID = ? AND PatientUsername = ?
-            """
-            cursor.execute(query, (appt_id, username))
+    # lookup and restore form one write unit, re-run from the top on lock contention
+    def unit(cursor):
+        cursor.execute(query, (appt_id, username))
 
         # Fetch appointment
         appt = cursor.fetchone()
 
         if appt is None:
             # Appointment does not exist OR does not belong to user
-            print(f"Appointment ID {appt_id} does not exist")
-            return
+            return f"Appointment ID {appt_id} does not exist"
 
         time = appt["Time"]
         caregiver_username = appt["CaregiverUsername"]
         vaccine_name = appt["VaccineName"]
+        slot = appt["Slot"]
 
-        # 1. Add caregiver availability back
-        add_availability = """
-            INSERT OR IGNORE INTO Availabilities(Time, Username)
-            VALUES (?, ?)
+        # 1. Give the slot back to the caregiver's day, re-creating the day if
+        #    it had been fully booked
+        free_slot = """
+            UPDATE Availabilities
+            SET FreeSlots = FreeSlots | ?
+            WHERE date(Time) = date(?) AND Username = ?
         """
-        cursor.execute(add_availability, (time, caregiver_username))
+        cursor.execute(free_slot, (slot_bit(slot), time, caregiver_username))
+        if cursor.rowcount == 0:
+            add_availability = """
+                INSERT OR IGNORE INTO Availabilities(Time, Username, FreeSlots)
+                VALUES (datetime(?), ?, ?)
+            """
+            cursor.execute(add_availability, (time, caregiver_username, slot_bit(slot)))
 
         # 2. Restore vaccine dose
         update_vaccine = """
@@ -520,16 +1063,171 @@ def cancel(tokens):
         delete_query = "DELETE FROM Appointments WHERE AppointmentID = ?"
         cursor.execute(delete_query, (appt_id,))
 
-        conn.commit()
+        # 4. Publish the cancellation to the change feed
+        append_event(cursor, "cancel", appointment_id=appt_id, date=time, caregiver=caregiver_username,
+                     patient=appt["PatientUsername"], vaccine=vaccine_name, slot=slot)
 
-        print(f"Appointment ID {appt_id} has been successfully canceled")
+        return f"Appointment ID {appt_id} has been successfully canceled"
+
+    # the ID tells which site booked the appointment, whatever site is selected
+    # now, so a keyed retry also finds its stored result there
+    try:
+        site = get_appointment_site(appt_id)
+    except ValueError:
+        print(f"Appointment ID {appt_id} does not exist")
+        return
 
+    try:
+        print(run_transaction(idempotent(unit, username, request_key, "cancel"), site=site))
     except sqlite3.Error:
         print("Please try again")
     except:
         print("Please try again")
-    finally:
-        cm.close_connection()
+
+
+def release_day(tokens):
+    # release_day <date>
+    # check 1: a caregiver gives up their own day
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: the length for tokens need to be exactly 2 to include the date
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+
+    try:
+        date = datetime.datetime.strptime(tokens[1], "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    username = current_caregiver.get_username()
+
+    # One write unit: every appointment of the day is either handed to another
+    # caregiver available that date or canceled, all with set-based statements
+    # driven by a temp table of decisions.
+    def unit(cursor):
+        get_appointments = """
+            SELECT AppointmentID, VaccineName, PatientUsername, Slot
+            FROM Appointments
+            WHERE date(Time) = date(?) AND CaregiverUsername = ?
+            ORDER BY AppointmentID ASC
+        """
+        cursor.execute(get_appointments, (date, username))
+        appointments = cursor.fetchall()
+
+        # same alphabetical priority reserve uses
+        get_caregivers = """
+            SELECT rowid AS RowID, Username, FreeSlots
+            FROM Availabilities
+            WHERE date(Time) = date(?) AND Username != ? AND FreeSlots != 0
+            ORDER BY Username ASC
+        """
+        cursor.execute(get_caregivers, (date, username))
+        caregivers = [[row["RowID"], row["Username"], row["FreeSlots"]] for row in cursor.fetchall()]
+
+        # each appointment keeps its slot and goes to the first caregiver who
+        # still has that slot free (slot 0 of a whole day in whole-day mode)
+        patients = {appt["AppointmentID"]: appt["PatientUsername"] for appt in appointments}
+        slots = {appt["AppointmentID"]: appt["Slot"] for appt in appointments}
+        taken = {}  # availability rowid -> bits handed out
+        decisions = []
+        for appt in appointments:
+            bit = slot_bit(appt["Slot"])
+            new_caregiver = None
+            for caregiver in caregivers:
+                if caregiver[2] & bit:
+                    caregiver[2] &= ~bit
+                    taken[caregiver[0]] = taken.get(caregiver[0], 0) | bit
+                    new_caregiver = caregiver[1]
+                    break
+            decisions.append((appt["AppointmentID"], new_caregiver, appt["VaccineName"]))
+
+        cursor.execute("""
+            CREATE TEMP TABLE IF NOT EXISTS ReleasedAppointments (
+                AppointmentID INTEGER PRIMARY KEY,
+                NewCaregiver varchar(255),
+                VaccineName varchar(255)
+            )
+        """)
+        cursor.execute("DELETE FROM temp.ReleasedAppointments")
+        cursor.executemany("INSERT INTO temp.ReleasedAppointments VALUES (?, ?, ?)", decisions)
+
+        # 1) hand placed appointments over and take their slots from the new caregivers
+        cursor.execute("""
+            UPDATE Appointments
+            SET CaregiverUsername = (
+                SELECT r.NewCaregiver FROM temp.ReleasedAppointments r
+                WHERE r.AppointmentID = Appointments.AppointmentID
+            )
+            WHERE AppointmentID IN (
+                SELECT AppointmentID FROM temp.ReleasedAppointments WHERE NewCaregiver IS NOT NULL
+            )
+        """)
+        cursor.executemany(
+            "UPDATE Availabilities SET FreeSlots = FreeSlots & ~? WHERE rowid = ?",
+            [(bits, rowid) for rowid, bits in taken.items()],
+        )
+        cursor.execute("DELETE FROM Availabilities WHERE date(Time) = date(?) AND FreeSlots = 0", (date,))
+
+        # 2) cancel the rest, giving their doses back per vaccine in one statement
+        cursor.execute("""
+            UPDATE Vaccines
+            SET Doses = Doses + (
+                SELECT COUNT(*) FROM temp.ReleasedAppointments r
+                WHERE r.NewCaregiver IS NULL AND r.VaccineName = Vaccines.Name
+            )
+            WHERE Name IN (SELECT VaccineName FROM temp.ReleasedAppointments WHERE NewCaregiver IS NULL)
+        """)
+        cursor.execute("""
+            DELETE FROM Appointments
+            WHERE AppointmentID IN (
+                SELECT AppointmentID FROM temp.ReleasedAppointments WHERE NewCaregiver IS NULL
+            )
+        """)
+
+        # 3) holds on the caregiver's day lapse, giving their doses back
+        get_holds = "SELECT HoldID FROM Holds WHERE date(Time) = date(?) AND CaregiverUsername = ?"
+        cursor.execute(get_holds, (date, username))
+        release_holds(cursor, [row["HoldID"] for row in cursor.fetchall()], "hold_released")
+
+        # 4) the releasing caregiver is off that day, so their own availability goes too
+        cursor.execute("DELETE FROM Availabilities WHERE date(Time) = date(?) AND Username = ?", (date, username))
+
+        # 5) publish every move and cancellation to the change feed, with the
+        #    same fields reserve and cancel publish
+        append_events(cursor, "reassign", [
+            {"appointment_id": appt_id, "date": date, "caregiver": new_caregiver, "patient": patients[appt_id],
+             "vaccine": vaccine, "slot": slots[appt_id], "from_caregiver": username}
+            for appt_id, new_caregiver, vaccine in decisions if new_caregiver is not None
+        ])
+        append_events(cursor, "cancel", [
+            {"appointment_id": appt_id, "date": date, "caregiver": username, "patient": patients[appt_id],
+             "vaccine": vaccine, "slot": slots[appt_id]}
+            for appt_id, new_caregiver, vaccine in decisions if new_caregiver is None
+        ])
+
+        return decisions
+
+    try:
+        decisions = run_transaction(unit, site=current_site)
+    except sqlite3.Error as e:
+        print("Release day failed", e)
+        return
+    except Exception as e:
+        print("Release day failed", e)
+        return
+
+    moved = [d for d in decisions if d[1] is not None]
+    canceled = [d for d in decisions if d[1] is None]
+    print(f"Released {date}: {len(moved)} appointments moved, {len(canceled)} appointments canceled")
+    for appt_id, new_caregiver, _ in moved:
+        print(f"Appointment ID {appt_id} moved to caregiver {new_caregiver}")
+    for appt_id, _, _ in canceled:
+        print(f"Appointment ID {appt_id} canceled")
 
 
 def add_doses(tokens):
@@ -547,43 +1245,28 @@ def add_doses(tokens):
 
     vaccine_name = tokens[1]
     doses = int(tokens[2])
-    vaccine = None
+
+    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
+    # else, update the existing entry by adding the new doses.
+    # Lookup and update run as one write unit, so concurrent restocks never lose doses.
+    def unit(cursor):
+        vaccine = Vaccine(vaccine_name, None, current_site)
+        vaccine.restock(cursor, doses)
+        append_event(cursor, "add_doses", vaccine=vaccine_name, doses=doses, total=vaccine.get_available_doses())
+
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
+        run_transaction(unit, site=current_site)
     except sqlite3.Error as e:
         print("Error occurred when adding doses", e)
         return
     except Exception as e:
         print("Error occurred when adding doses", e)
         return
-
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
-        try:
-            vaccine.save_to_db()
-        except sqlite3.Error as e:
-            print("Error occurred when adding doses", e)
-            return
-        except Exception as e:
-            print("Error occurred when adding doses", e)
-            return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
-        try:
-            vaccine.increase_available_doses(doses)
-        except sqlite3.Error as e:
-            print("Error occurred when adding doses", e)
-            return
-        except Exception as e:
-            print("Error occurred when adding doses", e)
-            return
     print("Doses updated!")
 
 
 def show_appointments(tokens):
-    # show_appointments
+    # show_appointments [<from> <to>]
 
     global current_caregiver, current_patient
 
@@ -592,74 +1275,432 @@ def show_appointments(tokens):
         print("Please login first")
         return
 
-    # Command should be just one token: "show_appointments"
-    if len(tokens) != 1:
+    # Command is either just "show_appointments" or also carries a date range
+    if len(tokens) != 1 and len(tokens) != 3:
         print("Please try again")
         return
 
-    cm = ConnectionManager()
-    conn = cm.create_connection()
-    cursor = conn.cursor()
+    start = None
+    end = None
+    if len(tokens) == 3:
+        try:
+            start = datetime.datetime.strptime(tokens[1], "%Y-%m-%d").strftime("%Y-%m-%d")
+            end = datetime.datetime.strptime(tokens[2], "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            print("Please try again")
+            return
 
     try:
-        # Case 1: caregiver is logged in
+        # Case 1: caregiver is logged in, seeing their patients at their site
         if current_caregiver is not None:
-            caregiver_username = current_caregiver.get_username()
-            query = """
-                SELECT AppointmentID, VaccineName, Time, PatientUsername
-                FROM Appointments
-                WHERE CaregiverUsername = ?
-                ORDER BY AppointmentID ASC
-            """
-            cursor.execute(query, (caregiver_username,))
-            rows = cursor.fetchall()
+            other_column = "PatientUsername"
+            rows = read_appointments(current_site, "CaregiverUsername", current_caregiver.get_username(),
+                                     other_column, start, end)
 
-            if len(rows) == 0:
-                print("No appointments scheduled")
-                return
+        # Case 2: patient is logged in, seeing their caregivers at every site
+        # they booked at, whichever site is selected now
+        else:
+            other_column = "CaregiverUsername"
+            patient_username = current_patient.get_username()
+            rows = []
+            for site in [None] + list_sites():
+                rows += read_appointments(site, "PatientUsername", patient_username, other_column, start, end)
+            rows.sort(key=lambda row: row["AppointmentID"])
+
+        if len(rows) == 0:
+            print("No appointments scheduled")
+            return
+
+        for row in rows:
+            appt_id = row["AppointmentID"]
+            vaccine = row["VaccineName"]
+            date = row["Time"]
+            other = row[other_column]
+            if slots_enabled():
+                print(f"{appt_id} {vaccine} {date} {other} {slot_label(row['Slot'])}")
+            else:
+                print(f"{appt_id} {vaccine} {date} {other}")
+
+    except sqlite3.Error:
+        print("Please try again")
+    except Exception:
+        print("Please try again")
+
+
+def read_appointments(site, user_column, username, other_column, start=None, end=None):
+    # one user's appointments at one site, ordered by ID
+    cm = ConnectionManager(site)
+    conn = cm.create_connection()
+    try:
+        # archived appointments are only looked at when the range reaches them
+        source = appointments_source(conn, start, cm.db_path)
+        date_filter = ""
+        params = [username]
+        if start is not None:
+            date_filter = "AND date(Time) BETWEEN date(?) AND date(?)"
+            params += [start, end]
+        query = f"""
+            SELECT AppointmentID, VaccineName, Time, {other_column}, Slot
+            FROM {source}
+            WHERE {user_column} = ? {date_filter}
+            ORDER BY AppointmentID ASC
+        """
+        return conn.execute(query, params).fetchall()
+    finally:
+        cm.close_connection()
+
+
+def archive_appointments(tokens):
+    # archive_appointments --before <date> [--vacuum]
+    # check 1: only caregivers run maintenance jobs
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: the cutoff date is required, vacuuming the hot file is optional
+    if len(tokens) not in (3, 4) or tokens[1] != "--before":
+        print("Please try again!")
+        return
+    vacuum = len(tokens) == 4
+    if vacuum and tokens[3] != "--vacuum":
+        print("Please try again!")
+        return
+
+    try:
+        before = datetime.datetime.strptime(tokens[2], "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    try:
+        moved, hot_size, archive_size = archive_appointments_before(before, vacuum=vacuum, site=current_site)
+    except sqlite3.Error as e:
+        print("Archiving appointments failed", e)
+        return
+    except Exception as e:
+        print("Archiving appointments failed", e)
+        return
 
-            for row in rows:
-                appt_id = row["AppointmentID"]
-                vaccine = row["VaccineName"]
-                date = row["Time"]
-                patient = row["PatientUsername"]
-                print(f"{appt_id} {vaccine} {date} {patient}")
+    print(f"Archived {moved} appointments dated before {before}")
+    print(f"Hot database size: {hot_size} bytes")
+    print(f"Archive database size: {archive_size} bytes")
 
-        # Case 2: patient is logged in
+
+def export_appointments(tokens):
+    # export_appointments <from> <to> --format csv|jsonl --out <path> [--gzip]
+    # check 1: rosters are exported by caregivers
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: two dates followed by the options
+    if len(tokens) < 7:
+        print("Please try again!")
+        return
+
+    fmt = None
+    out_path = None
+    compress = False
+    options = tokens[3:]
+    i = 0
+    while i < len(options):
+        if options[i] == "--format" and i + 1 < len(options):
+            fmt = options[i + 1].lower()
+            i += 2
+        elif options[i] == "--out" and i + 1 < len(options):
+            out_path = options[i + 1]
+            i += 2
+        elif options[i] == "--gzip":
+            compress = True
+            i += 1
         else:
-            patient_username = current_patient.get_username()
-            query = """
-                SELECT AppointmentID, VaccineName, Time, CaregiverUsername
-                FROM Appointments
-                WHERE PatientUsername = ?
-                ORDER BY AppointmentID ASC
-            """
-            cursor.execute(query, (patient_username,))
-            rows = cursor.fetchall()
+            print("Please try again!")
+            return
+    if fmt not in EXPORT_FORMATS or out_path is None:
+        print("Please try again!")
+        return
 
-            if len(rows) == 0:
-                print("No appointments scheduled")
-                return
+    try:
+        start = datetime.datetime.strptime(tokens[1], "%Y-%m-%d")
+        end = datetime.datetime.strptime(tokens[2], "%Y-%m-%d")
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+
+    cm = ConnectionManager(current_site)
+    conn = cm.create_connection()
+    # plain tuples are cheaper than sqlite3.Row when streaming millions of rows
+    conn.row_factory = None
+    cursor = conn.cursor()
+
+    try:
+        source = appointments_source(conn, start.strftime("%Y-%m-%d"), cm.db_path)
+        # slot start times are rendered by SQLite so rows stream through untouched
+        slot_column = slot_label_sql("Slot") if slots_enabled() else "NULL"
+        # compare the raw Time column so the range is served by AppointmentsByTime;
+        # the exclusive upper bound also covers values stored with a time part
+        query = f"""
+            SELECT Time, CaregiverUsername, AppointmentID, PatientUsername, VaccineName, {slot_column}
+            FROM {source}
+            WHERE Time >= ? AND Time < ?
+            ORDER BY Time ASC, CaregiverUsername ASC, Slot ASC, AppointmentID ASC
+        """
+        cursor.execute(query, (start.strftime("%Y-%m-%d"), (end + datetime.timedelta(days=1)).strftime("%Y-%m-%d")))
+
+        # sqlite steps the statement lazily, so rows are only produced as
+        # write_rows pulls each fetchmany() batch
+        with open_export_file(out_path, compress) as out:
+            count = write_rows(cursor, out, fmt, progress=lambda n: print(f"Exported {n} rows..."))
+    except sqlite3.Error as e:
+        print("Export failed", e)
+        return
+    except OSError as e:
+        print("Export failed", e)
+        return
+    finally:
+        cm.close_connection()
 
-            for row in rows:
-                appt_id = row["AppointmentID"]
-                vaccine = row["VaccineName"]
-                date = row["Time"]
-                caregiver = row["CaregiverUsername"]
-                print(f"{appt_id} {vaccine} {date} {caregiver}")
+    print(f"Exported {count} appointments to {out_path}")
 
+
+def generate_reminders_command(tokens):
+    # generate_reminders --days N --out <path> [--format csv|jsonl]
+    # check 1: the reminder job is run by staff
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: both --days and --out are required
+    options = parse_options(tokens, 1, ("days", "out", "format"))
+    if options is None or "days" not in options or "out" not in options:
+        print("Please try again!")
+        return
+    fmt = options.get("format", "jsonl").lower()
+    try:
+        days = int(options["days"])
+    except ValueError:
+        print("Please try again!")
+        return
+    if days <= 0 or fmt not in EXPORT_FORMATS:
+        print("Please try again!")
+        return
+
+    try:
+        with open_export_file(options["out"]) as out:
+            count, full = generate_reminders(out, days, fmt, site=current_site,
+                                             progress=lambda n: print(f"Wrote {n} reminders..."))
+    except sqlite3.Error as e:
+        print("Generating reminders failed", e)
+        return
+    except OSError as e:
+        print("Generating reminders failed", e)
+        return
+
+    kind = "full" if full else "incremental"
+    print(f"Wrote {count} reminder records ({kind} run) to {options['out']}")
+
+
+def utilization_report(tokens):
+    # utilization_report <from> <to>
+    # check 1: planning reports are for caregivers
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: the length for tokens need to be exactly 3 to include both dates
+    if len(tokens) != 3:
+        print("Please try again!")
+        return
+
+    try:
+        start = datetime.datetime.strptime(tokens[1], "%Y-%m-%d").date()
+        end = datetime.datetime.strptime(tokens[2], "%Y-%m-%d").date()
+    except ValueError:
+        print("Please enter a valid date!")
+        return
+    if end < start:
+        print("Please try again!")
+        return
+
+    days = day_range(start, end)
+    bounds = (days[0], (end + datetime.timedelta(days=1)).strftime("%Y-%m-%d"))
+    # the stock forecast runs from today on the stock on hand, so its burn rate
+    # comes from the week ending today, whatever range the report covers
+    today = datetime.date.today()
+    burn_days = day_range(today - datetime.timedelta(days=ROLLING_WINDOW - 1), today)
+    burn_bounds = (burn_days[0], (today + datetime.timedelta(days=1)).strftime("%Y-%m-%d"))
+
+    cm = ConnectionManager(current_site)
+    conn = cm.create_connection()
+    cursor = conn.cursor()
+
+    try:
+        source = appointments_source(conn, days[0], cm.db_path)
+
+        # pass 1: booked appointments per day and vaccine, over the report range
+        # and over the week the burn rate is taken from
+        get_booked = """
+            SELECT substr(Time, 1, 10) AS Day, VaccineName, COUNT(*) AS Booked
+            FROM {source}
+            WHERE Time >= ? AND Time < ?
+            GROUP BY Day, VaccineName
+        """
+        cursor.execute(get_booked.format(source=source), bounds)
+        booked_rows = cursor.fetchall()
+        burn_source = appointments_source(conn, burn_days[0], cm.db_path)
+        cursor.execute(get_booked.format(source=burn_source), burn_bounds)
+        burn_rows = cursor.fetchall()
+
+        # pass 2: free slot bitmaps per day (SQLite has no popcount, so the
+        # bitmaps are grouped and counted on this side)
+        get_open = """
+            SELECT substr(Time, 1, 10) AS Day, FreeSlots, COUNT(*) AS Days
+            FROM Availabilities
+            WHERE Time >= ? AND Time < ?
+            GROUP BY Day, FreeSlots
+        """
+        cursor.execute(get_open, bounds)
+        open_rows = cursor.fetchall()
+
+        # pass 3: doses restocked per day and vaccine
+        get_restocked = """
+            SELECT Time AS Day, VaccineName, SUM(Doses) AS Restocked
+            FROM Restocks
+            WHERE Time >= ? AND Time < ?
+            GROUP BY Day, VaccineName
+        """
+        cursor.execute(get_restocked, bounds)
+        restock_rows = cursor.fetchall()
+
+        # pass 4: stock on hand
+        cursor.execute("SELECT Name, Doses FROM Vaccines ORDER BY Name ASC")
+        stock = cursor.fetchall()
     except sqlite3.Error:
         print("Please try again")
+        return
     except Exception:
         print("Please try again")
+        return
     finally:
         cm.close_connection()
 
+    # a booked slot has left Availabilities, so offered = still free + booked
+    booked = densify(((row["Day"], row["Booked"]) for row in booked_rows), days)
+    still_open = densify(((row["Day"], free_slot_count(row["FreeSlots"]) * row["Days"]) for row in open_rows), days)
+    offered = [b + o for b, o in zip(booked, still_open)]
+    utilization = ratios(booked, offered)
+    booked_avg = rolling_mean(booked)
+
+    print("Date Offered Booked Utilization Booked7dAvg")
+    for i, day in enumerate(days):
+        used = "n/a" if utilization[i] is None else f"{utilization[i] * 100:.1f}%"
+        print(f"{day} {offered[i]} {booked[i]} {used} {booked_avg[i]:.2f}")
+
+    names = [row["Name"] for row in stock]
+    doses = [row["Doses"] for row in stock]
+    consumed = []
+    restocked = []
+    burn_rates = []
+    for name in names:
+        daily = densify(((row["Day"], row["Booked"]) for row in booked_rows if row["VaccineName"] == name), days)
+        consumed.append(sum(daily))
+        restocked.append(sum(row["Restocked"] for row in restock_rows if row["VaccineName"] == name))
+        # the burn rate is the rolling average of the week ending today
+        recent = densify(((row["Day"], row["Booked"]) for row in burn_rows if row["VaccineName"] == name), burn_days)
+        burn_rates.append(rolling_mean(recent)[-1])
+    forecast = stock_out_forecast(doses, burn_rates, today)
+
+    print("Vaccine Consumed Restocked Doses BurnRate DaysLeft StockOut")
+    if len(names) == 0:
+        print("No vaccines available")
+    for i, name in enumerate(names):
+        days_left, stock_out = forecast[i]
+        if days_left is None:
+            print(f"{name} {consumed[i]} {restocked[i]} {doses[i]} {burn_rates[i]:.2f} n/a n/a")
+        else:
+            print(f"{name} {consumed[i]} {restocked[i]} {doses[i]} {burn_rates[i]:.2f} {days_left:.1f} {stock_out}")
+
+
+def show_db_stats(tokens):
+    # show_db_stats
+    if len(tokens) != 1:
+        print("Please try again")
+        return
+
+    stats = get_transaction_stats()
+    print(f"Transactions: {stats['transactions']}")
+    print(f"Retries: {stats['retries']}")
+    print(f"Give-ups: {stats['give_ups']}")
+    print(f"Lock wait: {stats['lock_wait_seconds']:.3f}s")
+
+    login = login_throttle.get_metrics()
+    print(f"Login attempts: {login['attempts']}")
+    print(f"Throttled logins: {login['throttled']}")
+    print(f"Hashing CPU saved: {login['cpu_seconds_saved']:.3f}s")
+
+
+def changes_since_command(tokens):
+    # changes_since <seq> [--limit N]
+    # check 1: the feed is read by staff and downstream systems
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    # check 2: a sequence number, optionally followed by a limit
+    if len(tokens) != 2 and not (len(tokens) == 4 and tokens[2] == "--limit"):
+        print("Please try again!")
+        return
+    try:
+        seq = int(tokens[1])
+        limit = int(tokens[3]) if len(tokens) == 4 else None
+    except ValueError:
+        print("Please try again!")
+        return
+
+    last = seq
+    try:
+        for event_seq, kind, payload, _ in changes_since(seq, limit, site=current_site):
+            print(f"{event_seq} {kind} {json.dumps(payload, sort_keys=True)}")
+            last = event_seq
+    except sqlite3.Error as e:
+        print("Reading changes failed", e)
+        return
+    print(f"Last sequence number: {last}")
+
+
+def compact_events_command(tokens):
+    # compact_events <seq>
+    global current_caregiver
+    if current_caregiver is None:
+        print("Please login as a caregiver first!")
+        return
+
+    if len(tokens) != 2:
+        print("Please try again!")
+        return
+    try:
+        seq = int(tokens[1])
+    except ValueError:
+        print("Please try again!")
+        return
+
+    try:
+        removed = compact_events(seq, site=current_site)
+    except sqlite3.Error as e:
+        print("Compacting events failed", e)
+        return
+    print(f"Compacted {removed} events up to sequence number {seq}")
+
 
 def logout(tokens):
     # logout
 
-    global current_caregiver, current_patient
+    global current_caregiver, current_patient, current_site
 
     if len(tokens) != 1:
         print("Please try again")
@@ -673,6 +1714,7 @@ def logout(tokens):
     # Clear both caregiver and patient
     current_caregiver = None
     current_patient = None
+    current_site = None
 
     print("Successfully logged out")
 
@@ -681,15 +1723,30 @@ def start():
     stop = False
     print("*** Please enter one of the following commands ***")
     print("> create_patient <username> <password>")  # //TODO: implement create_patient (Part 1)
-    print("> create_caregiver <username> <password>")
+    print("> create_caregiver <username> <password> [<site>]")
     print("> login_patient <username> <password>")  # // TODO: implement login_patient (Part 1)
     print("> login_caregiver <username> <password>")
-    print("> search_caregiver_schedule <date>")  # // TODO: implement search_caregiver_schedule (Part 2)
-    print("> reserve <date> <vaccine>")  # // TODO: implement reserve (Part 2)
+    print("> search_caregiver_schedule <date> [--all-sites]")  # // TODO: implement search_caregiver_schedule (Part 2)
+    print("> reserve <date> <vaccine> [--at <HH:MM>] [--key <request_key>]")  # // TODO: implement reserve (Part 2)
+    print("> hold <date> <vaccine> [--at <HH:MM>] [--key <request_key>]")
+    print("> confirm <hold_id>")
+    print("> batch_reserve <file>")
     print("> upload_availability <date>")
-    print("> cancel <appointment_id>")  # // TODO: implement cancel (extra credit)
+    print("> sync_availability <file>")
+    print("> set_shift <HH:MM> <HH:MM>")
+    print("> cancel <appointment_id> [--key <request_key>]")  # // TODO: implement cancel (extra credit)
+    print("> release_day <date>")
     print("> add_doses <vaccine> <number>")
-    print("> show_appointments")  # // TODO: implement show_appointments (Part 2)
+    print("> show_appointments [<from> <to>]")  # // TODO: implement show_appointments (Part 2)
+    print("> archive_appointments --before <date> [--vacuum]")
+    print("> export_appointments <from> <to> --format csv|jsonl --out <path> [--gzip]")
+    print("> generate_reminders --days N --out <path> [--format csv|jsonl]")
+    print("> utilization_report <from> <to>")
+    print("> show_db_stats")
+    print("> changes_since <seq> [--limit N]")
+    print("> compact_events <seq>")
+    print("> create_site <name> <db_path> <latitude> <longitude>")
+    print("> select_site <site> | select_site nearest <latitude> <longitude>")
     print("> logout")  # // TODO: implement logout (Part 2)
     print("> quit")
     print()
@@ -718,17 +1775,49 @@ def start():
             search_caregiver_schedule(tokens)
         elif operation == "reserve":
             reserve(tokens)
+        elif operation == "hold":
+            hold(tokens)
+        elif operation == "confirm":
+            confirm(tokens)
+        elif operation == "batch_reserve":
+            batch_reserve(tokens)
         elif operation == "upload_availability":
             upload_availability(tokens)
+        elif operation == "sync_availability":
+            sync_availability(tokens)
+        elif operation == "set_shift":
+            set_shift(tokens)
         elif operation == "cancel":
             cancel(tokens)
+        elif operation == "release_day":
+            release_day(tokens)
         elif operation == "add_doses":
             add_doses(tokens)
         elif operation == "show_appointments":
             show_appointments(tokens)
+        elif operation == "archive_appointments":
+            archive_appointments(tokens)
+        elif operation == "export_appointments":
+            export_appointments(tokens)
+        elif operation == "generate_reminders":
+            generate_reminders_command(tokens)
+        elif operation == "utilization_report":
+            utilization_report(tokens)
+        elif operation == "show_db_stats":
+            show_db_stats(tokens)
+        elif operation == "changes_since":
+            changes_since_command(tokens)
+        elif operation == "compact_events":
+            compact_events_command(tokens)
+        elif operation == "create_site":
+            create_site(tokens)
+        elif operation == "select_site":
+            select_site(tokens)
         elif operation == "logout":
             logout(tokens)
         elif operation == "quit":
+            # in-memory mode writes its final snapshot here
+            shutdown_backends()
             print("Bye!")
             stop = True
         else:
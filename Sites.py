@@ -0,0 +1,184 @@
+import math
+import os
+import sqlite3
+import sys
+import threading
+sys.path.append("../db/*")
+from db.Backend import get_backend
+from db.Migrations import ensure_schema, migrate
+
+
+'''
+Site registry for multi-site deployments.
+
+Accounts (Patients, Caregivers, Shifts) and the Sites registry live in the
+shared database at DBPATH. Each site keeps its booking data (Availabilities,
+Vaccines, Restocks, Appointments, Events, ...) in its own SQLite file. Writes at
+different sites then take different locks and can run in parallel. Site None is
+the default site, whose booking data stays in DBPATH itself, so a deployment
+without any registered site behaves exactly as before.
+
+Every site also has a number, handed out in registration order, which picks
+the range of appointment IDs the site books from (db/AppointmentIds.py).
+
+The registry is small and rarely changes, so it is cached per process. It is
+reloaded after register_site, and when a site name is missing from it, which
+picks up sites registered by other processes.
+'''
+
+# appointment IDs per site number
+SITE_ID_RANGE = 1000000000
+
+sites_cache = None
+
+sites_lock = threading.Lock()
+
+
+def accounts_connection():
+    # the registry is read below ConnectionManager, which routes through it
+    conn = get_backend(os.getenv("DBPATH")).connect(5.0)
+    conn.row_factory = sqlite3.Row
+    ensure_schema(conn, os.getenv("DBPATH"))
+    return conn
+
+
+def load_sites(reload=False):
+    global sites_cache
+    with sites_lock:
+        if sites_cache is None or reload:
+            conn = accounts_connection()
+            try:
+                rows = conn.execute(
+                    "SELECT Name, DBPath, Latitude, Longitude, Number FROM Sites ORDER BY Name ASC"
+                ).fetchall()
+            finally:
+                conn.close()
+            sites_cache = {
+                row["Name"]: (row["DBPath"], row["Latitude"], row["Longitude"], row["Number"]) for row in rows
+            }
+        return sites_cache
+
+
+def list_sites():
+    return list(load_sites())
+
+
+def find_site(site):
+    # registry entry of `site`, reloading once in case another process added it
+    sites = load_sites()
+    if site not in sites:
+        sites = load_sites(reload=True)
+    return sites.get(site)
+
+
+def site_exists(site):
+    return find_site(site) is not None
+
+
+def get_site_db_path(site):
+    if site is None:
+        return os.getenv("DBPATH")
+    entry = find_site(site)
+    if entry is None:
+        raise ValueError("Unknown site: " + site)
+    return entry[0]
+
+
+def get_site_number(site):
+    if site is None:
+        return 0
+    entry = find_site(site)
+    if entry is None:
+        raise ValueError("Unknown site: " + site)
+    return entry[3]
+
+
+def get_site_by_number(number):
+    # the site registered as `number`, reloading once in case another process added it
+    if number == 0:
+        return None
+    for reload in (False, True):
+        for name, entry in load_sites(reload).items():
+            if entry[3] == number:
+                return name
+    raise ValueError("Unknown site number: " + str(number))
+
+
+def same_file(path, other):
+    return os.path.realpath(path) == os.path.realpath(other)
+
+
+def check_site_path(db_path):
+    # a site needs a booking database of its own: not DBPATH, not another
+    # site's file, and not some unrelated SQLite file that happens to exist
+    if same_file(db_path, os.getenv("DBPATH")):
+        raise ValueError("Site database must not be DBPATH: " + db_path)
+    for name, (other, _, _, _) in load_sites(reload=True).items():
+        if same_file(db_path, other):
+            raise ValueError(f"Site database already used by site {name}: {db_path}")
+    if os.path.exists(db_path) and os.path.getsize(db_path) > 0:
+        conn = sqlite3.connect(db_path)
+        try:
+            found = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Appointments'"
+            ).fetchone()
+        finally:
+            conn.close()
+        if found is None:
+            raise ValueError("Not a booking database: " + db_path)
+
+
+def register_site(name, db_path, latitude, longitude):
+    global sites_cache
+    check_site_path(db_path)
+    # a new site file gets the booking tables; an existing one is brought up to date
+    site_conn = sqlite3.connect(db_path)
+    try:
+        migrate(site_conn)
+        ranges = {row[0] for row in site_conn.execute(
+            "SELECT DISTINCT (AppointmentID - 1) / ? FROM Appointments", (SITE_ID_RANGE,)
+        ).fetchall()}
+    finally:
+        site_conn.close()
+
+    conn = accounts_connection()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        number = conn.execute("SELECT COALESCE(MAX(Number), 0) + 1 FROM Sites").fetchone()[0]
+        # appointments already in an existing file must be numbered from the
+        # range this site gets, or their IDs would point at another site
+        if len(ranges - {number}) > 0:
+            raise ValueError(f"Appointments in {db_path} were booked under another site's IDs")
+        conn.execute(
+            "INSERT INTO Sites(Name, DBPath, Latitude, Longitude, Number) VALUES (?, ?, ?, ?, ?)",
+            (name, db_path, latitude, longitude, number),
+        )
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    with sites_lock:
+        sites_cache = None
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    # great-circle distance (haversine)
+    p1 = math.radians(lat1)
+    p2 = math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 6371.0 * 2 * math.asin(math.sqrt(a))
+
+
+def nearest_site(latitude, longitude):
+    best = None
+    for name, (_, lat, lon, _) in load_sites().items():
+        if lat is None or lon is None:
+            continue
+        d = distance_km(latitude, longitude, lat, lon)
+        if best is None or d < best[1]:
+            best = (name, d)
+    return None if best is None else best[0]
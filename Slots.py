@@ -0,0 +1,93 @@
+import os
+
+
+'''
+Sub-day appointment slots.
+
+With SLOT_MINUTES set, a caregiver-day is split into slots of that length and
+its free slots are kept as a bitmap in Availabilities.FreeSlots: bit i is set
+while the slot starting SLOT_DAY_START + i * SLOT_MINUTES is free. Finding the
+first free slot is then a constant-time bit operation on that integer, and
+booking or freeing a slot is a single bitwise UPDATE. The bitmap has to fit a
+signed 64-bit SQLite INTEGER, so at most MAX_SLOTS slots follow SLOT_DAY_START.
+
+Without SLOT_MINUTES (the default) every caregiver-day is one slot: bitmap 1,
+slot 0. This is the original one-appointment-per-caregiver-day model.
+'''
+
+SLOT_MINUTES = int(os.getenv("SLOT_MINUTES", "0"))
+
+SLOT_DAY_START = os.getenv("SLOT_DAY_START", "06:00")
+
+# shift used for caregivers that never ran set_shift
+DEFAULT_SHIFT_START = os.getenv("SHIFT_START", "09:00")
+
+DEFAULT_SHIFT_END = os.getenv("SHIFT_END", "17:00")
+
+MAX_SLOTS = 63
+
+WHOLE_DAY = 1
+
+
+def slots_enabled():
+    return SLOT_MINUTES > 0
+
+
+def parse_clock(value):
+    # "HH:MM" -> minutes after midnight
+    hours, minutes = value.split(":")
+    hours = int(hours)
+    minutes = int(minutes)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError("Invalid time: " + value)
+    return hours * 60 + minutes
+
+
+def shift_bitmap(start_minute, end_minute):
+    # bitmap of every slot that lies entirely inside [start, end)
+    if not slots_enabled():
+        return WHOLE_DAY
+    day_start = parse_clock(SLOT_DAY_START)
+    first = max(0, -(-(start_minute - day_start) // SLOT_MINUTES))
+    last = min(MAX_SLOTS, (end_minute - day_start) // SLOT_MINUTES)
+    if last <= first:
+        return 0
+    return ((1 << last) - 1) & ~((1 << first) - 1)
+
+
+def slot_bit(slot):
+    return 1 << slot
+
+
+def first_free_slot(bitmap):
+    # index of the lowest set bit, or -1 when nothing is free
+    if bitmap == 0:
+        return -1
+    return (bitmap & -bitmap).bit_length() - 1
+
+
+def free_slot_count(bitmap):
+    return bin(bitmap).count("1")
+
+
+def slot_label(slot):
+    # "HH:MM" start time of a slot, or None in whole-day mode
+    if not slots_enabled():
+        return None
+    minute = parse_clock(SLOT_DAY_START) + slot * SLOT_MINUTES
+    return f"{minute // 60:02d}:{minute % 60:02d}"
+
+
+def slot_label_sql(column):
+    # SQL expression computing slot_label() from an integer slot column
+    start = parse_clock(SLOT_DAY_START)
+    minute = f"({start} + {column} * {SLOT_MINUTES})"
+    return f"printf('%02d:%02d', {minute} / 60, {minute} % 60)"
+
+
+def slot_for_clock(value):
+    # slot index starting at "HH:MM"; raises ValueError if no slot starts then
+    offset = parse_clock(value) - parse_clock(SLOT_DAY_START)
+    if not slots_enabled() or offset < 0 or offset % SLOT_MINUTES != 0 or offset // SLOT_MINUTES >= MAX_SLOTS:
+        raise ValueError("No slot starts at " + value)
+    return offset // SLOT_MINUTES
@@ -0,0 +1,86 @@
+import os
+import random
+import sqlite3
+import sys
+import time
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+
+
+'''
+Bounded retry for write transactions under lock contention.
+
+A write unit is a function taking a cursor. run_transaction opens a connection,
+takes the write lock up front with BEGIN IMMEDIATE (waiting up to the
+connection's busy timeout), runs the unit and commits. If SQLite still reports
+the database as busy or locked, everything is rolled back and the whole unit is
+re-run from the start on a fresh connection after an exponential backoff with
+full jitter, so a retry never sees half of an earlier attempt. Units must not
+print; they return whatever the caller should report. With a site given the
+unit runs against that site's database (see db.Sites).
+'''
+
+TRANSACTION_MAX_ATTEMPTS = int(os.getenv("DB_RETRY_ATTEMPTS", "5"))
+
+TRANSACTION_BASE_DELAY = int(os.getenv("DB_RETRY_BASE_DELAY_MS", "10")) / 1000.0
+
+TRANSACTION_MAX_DELAY = int(os.getenv("DB_RETRY_MAX_DELAY_MS", "500")) / 1000.0
+
+# process-wide counters, see get_transaction_stats()
+transaction_stats = {
+    "transactions": 0,
+    "retries": 0,
+    "give_ups": 0,
+    "lock_wait_seconds": 0.0,
+}
+
+
+def is_lock_error(err):
+    message = str(err).lower()
+    return "locked" in message or "busy" in message
+
+
+def backoff_delay(attempt):
+    # full jitter: uniform in [0, min(max, base * 2^(attempt - 1))]
+    return random.uniform(0, min(TRANSACTION_MAX_DELAY, TRANSACTION_BASE_DELAY * (2 ** (attempt - 1))))
+
+
+def run_transaction(unit, attempts=TRANSACTION_MAX_ATTEMPTS, site=None):
+    attempt = 1
+    while True:
+        cm = ConnectionManager(site)
+        conn = cm.create_connection()
+        began = time.perf_counter()
+        locked = False
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            locked = True
+            transaction_stats["lock_wait_seconds"] += time.perf_counter() - began
+            result = unit(conn.cursor())
+            conn.commit()
+            transaction_stats["transactions"] += 1
+            return result
+        except sqlite3.OperationalError as e:
+            if not locked:
+                transaction_stats["lock_wait_seconds"] += time.perf_counter() - began
+            conn.rollback()
+            if not is_lock_error(e):
+                raise
+            if attempt >= attempts:
+                transaction_stats["give_ups"] += 1
+                raise
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            cm.close_connection()
+
+        transaction_stats["retries"] += 1
+        delay = backoff_delay(attempt)
+        time.sleep(delay)
+        transaction_stats["lock_wait_seconds"] += delay
+        attempt += 1
+
+
+def get_transaction_stats():
+    return dict(transaction_stats)
@@ -1,17 +1,19 @@
 import sqlite3
+import datetime
 import sys
 sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
 
 
 class Vaccine:
-    def __init__(self, vaccine_name, available_doses):
+    def __init__(self, vaccine_name, available_doses, site=None):
         self.vaccine_name = vaccine_name
         self.available_doses = available_doses
+        self.site = site
 
     # getters
     def get(self):
-        cm = ConnectionManager()
+        cm = ConnectionManager(self.site)
         conn = cm.create_connection()
         cursor = conn.cursor()
 
@@ -39,13 +41,14 @@ class Vaccine:
         if self.available_doses is None or self.available_doses <= 0:
             raise ValueError("Argument cannot be negative!")
 
-        cm = ConnectionManager()
+        cm = ConnectionManager(self.site)
         conn = cm.create_connection()
         cursor = conn.cursor()
 
         add_doses = "INSERT INTO VACCINES VALUES (?, ?)"
         try:
             cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
+            self.record_restock(cursor, self.available_doses)
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
         except sqlite3.Error:
@@ -60,13 +63,14 @@ class Vaccine:
             raise ValueError("Argument cannot be negative!")
         self.available_doses += num
 
-        cm = ConnectionManager()
+        cm = ConnectionManager(self.site)
         conn = cm.create_connection()
         cursor = conn.cursor()
 
         update_vaccine_availability = "UPDATE vaccines SET Doses = ? WHERE name = ?"
         try:
             cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            self.record_restock(cursor, num)
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
         except sqlite3.Error:
@@ -75,13 +79,33 @@ class Vaccine:
         finally:
             cm.close_connection()
 
+    # Add num doses inside the caller's transaction, creating the vaccine if needed
+    def restock(self, cursor, num):
+        if num is None or num <= 0:
+            raise ValueError("Argument cannot be negative!")
+
+        cursor.execute("SELECT Doses FROM Vaccines WHERE Name = ?", (self.vaccine_name,))
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("INSERT INTO Vaccines VALUES (?, ?)", (self.vaccine_name, num))
+            self.available_doses = num
+        else:
+            cursor.execute("UPDATE Vaccines SET Doses = Doses + ? WHERE Name = ?", (num, self.vaccine_name))
+            self.available_doses = row[0] + num
+        self.record_restock(cursor, num)
+
+    # Log a restock of num doses, in the caller's transaction
+    def record_restock(self, cursor, num):
+        add_restock = "INSERT INTO Restocks(Time, VaccineName, Doses) VALUES (?, ?, ?)"
+        cursor.execute(add_restock, (datetime.date.today().strftime("%Y-%m-%d"), self.vaccine_name, num))
+
     # Decrement the available doses
     def decrease_available_doses(self, num):
         if self.available_doses - num < 0:
             ValueError("Not enough available doses!")
         self.available_doses -= num
 
-        cm = ConnectionManager()
+        cm = ConnectionManager(self.site)
         conn = cm.create_connection()
         cursor = conn.cursor()
 
@@ -1,13 +1,33 @@
+CREATE TABLE Sites (
+    Name varchar(255),
+    DBPath varchar(1024) NOT NULL,
+    Latitude REAL,
+    Longitude REAL,
+    Number INTEGER,
+    PRIMARY KEY (Name)
+);
+
+CREATE UNIQUE INDEX SitesByNumber ON Sites(Number);
+
 CREATE TABLE Caregivers (
     Username varchar(255),
     Salt BINARY(16),
     Hash BINARY(16),
+    Site varchar(255) REFERENCES Sites(Name),
+    PRIMARY KEY (Username)
+);
+
+CREATE TABLE Shifts (
+    Username varchar(255) REFERENCES Caregivers,
+    StartMinute int,
+    EndMinute int,
     PRIMARY KEY (Username)
 );
 
 CREATE TABLE Availabilities (
     Time date,
     Username varchar(255) REFERENCES Caregivers,
+    FreeSlots INTEGER NOT NULL DEFAULT 1,
     PRIMARY KEY (Time, Username)
 );
 
@@ -17,6 +37,14 @@ CREATE TABLE Vaccines (
     PRIMARY KEY (Name)
 );
 
+CREATE TABLE Restocks (
+    Time date,
+    VaccineName varchar(255) REFERENCES Vaccines(Name),
+    Doses int
+);
+
+CREATE INDEX RestocksByTime ON Restocks(Time);
+
 CREATE TABLE Patients (
     Username varchar(255),
     Salt BINARY(16),
@@ -30,7 +58,53 @@ CREATE TABLE Appointments (
     CaregiverUsername varchar(255),
     PatientUsername varchar(255),
     VaccineName varchar(255),
+    Slot int NOT NULL DEFAULT 0,
     FOREIGN KEY (CaregiverUsername) REFERENCES Caregivers(Username),
     FOREIGN KEY (PatientUsername)   REFERENCES Patients(Username),
     FOREIGN KEY (VaccineName)       REFERENCES Vaccines(Name)
 );
+
+CREATE INDEX AppointmentsByTime ON Appointments(Time, CaregiverUsername, Slot);
+
+CREATE TABLE AppointmentSequence (
+    LastID INTEGER
+);
+
+CREATE TABLE ArchiveState (
+    Cutoff date
+);
+
+CREATE TABLE ReminderState (
+    Watermark INTEGER,
+    WindowEnd date
+);
+
+CREATE TABLE RequestKeys (
+    Username varchar(255),
+    RequestKey varchar(255),
+    Operation varchar(32),
+    Result varchar(255),
+    CreatedAt REAL,
+    PRIMARY KEY (Username, RequestKey)
+) WITHOUT ROWID;
+
+CREATE INDEX RequestKeysByAge ON RequestKeys(CreatedAt);
+
+CREATE TABLE Events (
+    Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    Kind varchar(32),
+    Payload TEXT,
+    CreatedAt REAL
+);
+
+CREATE TABLE Holds (
+    HoldID INTEGER PRIMARY KEY AUTOINCREMENT,
+    Time date,
+    CaregiverUsername varchar(255) REFERENCES Caregivers,
+    PatientUsername varchar(255) REFERENCES Patients,
+    VaccineName varchar(255) REFERENCES Vaccines(Name),
+    Slot int NOT NULL DEFAULT 0,
+    ExpiresAt REAL NOT NULL
+);
+
+CREATE INDEX HoldsByExpiry ON Holds(ExpiresAt);